@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Benchmarks for crossword_solve.
+#
+# Solves example1.puz, example2.puz and synthetic constraint sets of varying answer length,
+# answer count and crossing density against the bundled wordlist (bench_words.txt), and reports
+# for each: wall time, peak memory, candidates per constraint, nodes expanded and pruning ratio.
+#
+# Each synthetic constraint set is made from randomly chosen words that cross where their letters
+# match, so it has at least one solution. A fixed seed makes the runs comparable.
+
+import argparse
+import itertools
+import os
+import random
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+from crossword_solve import (DEFAULT_CACHE_DIR, SearchStats, WordLists,
+                             get_answers, get_solutions, get_xvardatas, get_xvars, read_constraints)
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_WORDS_FILE = os.path.join(BENCH_DIR, 'bench_words.txt')
+EXAMPLE_FILES = [os.path.join(BENCH_DIR, name) for name in ['example1.puz', 'example2.puz']]
+DEFAULT_LIMIT = 100000  # Caps the solutions enumerated per constraint set
+DEFAULT_SEED = 1
+
+LENGTHS = [4, 6, 8]
+ANSWER_COUNTS = [2, 3, 4]
+XVARS_PER_ANSWER = [1, 2]  # Crossing density. At most ten xvars are used in all.
+
+
+def make_constraints(rng: random.Random, words_by_length: Dict[int, List[str]],
+                     answer_count: int, length: int, xvar_count: int) -> List[str]:
+    """Return constraints for answer_count answers of the given length, with up to xvar_count crossings
+    and one given letter per answer.
+    """
+    words = rng.sample(words_by_length[length], answer_count)
+    cells = [['*'] * length for _ in words]
+    xvar = 0
+    for _ in range(1000):
+        if xvar == xvar_count:
+            break
+        a, b = rng.sample(range(answer_count), 2)
+        pos_a, pos_b = rng.randrange(length), rng.randrange(length)
+        if cells[a][pos_a] == '*' and cells[b][pos_b] == '*' and words[a][pos_a] == words[b][pos_b]:
+            cells[a][pos_a] = cells[b][pos_b] = str(xvar)
+            xvar += 1
+    for a in range(answer_count):
+        free = [pos for pos in range(length) if cells[a][pos] == '*']
+        if free:
+            pos = rng.choice(free)
+            cells[a][pos] = words[a][pos]
+    return [''.join(row) for row in cells]
+
+
+def get_cases(word_lists: WordLists, seed: int) -> List[Tuple[str, List[str]]]:
+    cases = [(os.path.basename(path), read_constraints(path)) for path in EXAMPLE_FILES]
+    rng = random.Random(seed)
+    words_by_length = {length: word_lists.matching('*' * length) for length in LENGTHS}
+    for length, answer_count, density in itertools.product(LENGTHS, ANSWER_COUNTS, XVARS_PER_ANSWER):
+        xvar_count = min(10, answer_count * density)
+        constraints = make_constraints(rng, words_by_length, answer_count, length, xvar_count)
+        cases.append((f'len={length},answers={answer_count},xvars={xvar_count}', constraints))
+    return cases
+
+
+def run_case(word_lists: WordLists, constraints: List[str], limit: int) -> Tuple[int, SearchStats]:
+    """Filter the candidates and enumerate up to limit solutions. Return the solution count and stats."""
+    xvardatas = get_xvardatas(constraints, get_xvars(constraints))
+    answers = get_answers(word_lists, constraints, xvardatas)
+    stats = SearchStats([len(words) for words in answers])
+    solution_count = sum(1 for _ in itertools.islice(get_solutions(answers, xvardatas, stats), limit))
+    return solution_count, stats
+
+
+def main(words_files: List[str], cache_dir: str, seed: int, limit: int) -> None:
+    start = time.perf_counter()
+    word_lists = WordLists.load(words_files, cache_dir)
+    print(f'Loaded {", ".join(words_files)} in {time.perf_counter() - start:.3f}s')
+    print(f'{"Case":32} {"Seconds":>9} {"Peak KiB":>9} {"Solutions":>9} {"Nodes":>9} {"Pruned":>7}  Candidates')
+    for name, constraints in get_cases(word_lists, seed):
+        # Time without tracemalloc, which slows allocation, then measure peak memory in a second run.
+        start = time.perf_counter()
+        solution_count, stats = run_case(word_lists, constraints, limit)
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        run_case(word_lists, constraints, limit)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:32} {seconds:9.4f} {peak / 1024:9.1f} {solution_count:9} {stats.nodes:9}'
+              f' {stats.pruning_ratio:7.3f}  {stats.candidates}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark crossword_solve on example and synthetic constraint sets.')
+    parser.add_argument('-w', '--words', type=str, action='append',
+            help=f'Specify path of words file; repeat for several [Default is {BENCH_WORDS_FILE}]')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+            help=f'Specify directory of cached word indexes [Default is {DEFAULT_CACHE_DIR}]')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+            help=f'Specify seed for the synthetic constraint sets [Default is {DEFAULT_SEED}]')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT,
+            help=f'Stop each case after this many solutions [Default is {DEFAULT_LIMIT}]')
+    args = parser.parse_args()
+
+    main(args.words if args.words else [BENCH_WORDS_FILE], args.cache_dir, args.seed, args.limit)
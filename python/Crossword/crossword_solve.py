@@ -2,14 +2,28 @@
 
 import argparse
 from collections import Counter
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+import functools
+import hashlib
 import itertools
-import re
+import json
+import math
+import mmap
+import multiprocessing
+import os
 import string
+import struct
 import sys
-from typing import List
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import unittest
 
+import numpy as np
+from numpy.typing import NDArray
+
 
 XWORD_HELP = r"""
   Allow user to specify constraints and word files for crossword puzzles. Specifically,
@@ -20,8 +34,7 @@ XWORD_HELP = r"""
     - Letters (lower or upper case) represent characters as they must be in each answer.
     - Asterisks (*) represent free (i.e., unconstrained) letters.
     - Digits (0-9) represent letters that must match the letters used in other answers.
-      (A constraints file with more than ten such tags would likely have a very long runtime.
-      This script does not lend itself to solving an entire crossword puzzle.)
+      (A constraints file can have at most ten such tags. To fill an entire crossword puzzle, use a grid file.)
 
   Example #1:
     * There are two answers: 5 letters starting with a 'T', and 4 letters starting with a 'W'.
@@ -42,11 +55,25 @@ XWORD_HELP = r"""
         DUNGAREE
         FRACKING
  
+  Grid files:
+    * With --grid, the input is a crossword grid, with one line per row, in which
+        - '#' represents a black square,
+        - Letters represent given letters, and
+        - Any other character (e.g., '.') represents an empty square.
+    * The across and down answers, and the squares where they cross, are found from the grid,
+      and the grid is filled with distinct words from the wordlist. For example, example3.grid:
+        #....
+        .....
+        .....
+        ....#
+
   Some intersection scenarios have no solutions, while others have a huge number of solutions.
   Execution time can rise rapidly with the number of answers/constraints, but can also remain small if each constraint
     only has a small number of answers that satisfy it.
   To aid in crossword puzzle authoring, proper nouns can be added to the wordlist.
   For themed crosswords, words or phrases relevant to the theme can be added to the wordlist.
+  Several wordlists (e.g., a dictionary plus a theme list) can be given with repeated -w options.
+  A wordlist line may end with a semicolon and a score (e.g., "tidal;60"). Higher-scoring words are tried first.
 """
 # Developer note: Numeric matched wildcards are called xvars. The possible values are called xvals.
 # TODO: Add check to ensure that each intersection variable appears no more than once in a given constraint.
@@ -54,6 +81,24 @@ XWORD_HELP = r"""
 
 DEFAULT_CONSTRAINTS_FILE = './constraints.puz'
 DEFAULT_WORDS_FILE = '/usr/share/dict/words'
+CHUNKS_PER_JOB = 16  # Split work finely, so that workers given small branches go on to take more chunks
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'crossword_solve')
+
+# Layout of a cached word index file (integers are little-endian):
+#   header:  magic, version, wordlist mtime (ns), wordlist size, wordlist SHA-1, count of word lengths
+#   entries: for each word length: length, word count, offset of words, offset of scores, offset of bitsets
+#   words:   for each word length, its words concatenated (all the same width, so no separators),
+#            from highest to lowest score, then alphabetically
+#   scores:  for each word length, the int32 score of each word
+#   bitsets: for each word length, for each position, for each letter a-z, a bitset over its words
+INDEX_MAGIC = b'XWIDX'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<5sBqq20sI')
+INDEX_ENTRY = struct.Struct('<IIQQQ')
+
+# A wordlist line is a word, optionally followed by a semicolon and a score (e.g., "lukewarm;60").
+# Higher-scoring words are tried first.
+DEFAULT_WORD_SCORE = 50
 
 
 # Stores the data regarding the intersections of two answers
@@ -66,6 +111,33 @@ class XvarData:
     pos1: int
 
  
+# Counters describing the work done by a search, for --stats and benchmarks.
+@dataclass
+class SearchStats:
+    candidates: List[int] = field(default_factory=list)  # Candidate answers per constraint, before the search
+    nodes: int = 0  # Answers tried by the search
+    pruned: int = 0  # Answers tried that were rejected, because a crossing answer was left with no candidates
+    seconds: float = 0.0
+
+    @property
+    def pruning_ratio(self) -> float:
+        return self.pruned / self.nodes if self.nodes else 0.0
+
+    def add(self, nodes: int, pruned: int) -> None:
+        self.nodes += nodes
+        self.pruned += pruned
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'candidates': self.candidates, 'nodes': self.nodes, 'pruned': self.pruned,
+                'pruning_ratio': round(self.pruning_ratio, 6), 'seconds': round(self.seconds, 6)}
+
+    def __str__(self):
+        return '\n'.join([f'Candidates per constraint: {self.candidates}',
+                          f'Nodes expanded: {self.nodes}',
+                          f'Nodes pruned: {self.pruned} (pruning ratio {self.pruning_ratio:.3f})',
+                          f'Search seconds: {self.seconds:.6f}'])
+
+ 
 # Note: Constraint strings have already been converted to lowercase.
 def get_regexpr_str(constraint: str):
     constraint = constraint.replace('*', '.')
@@ -74,15 +146,54 @@ def get_regexpr_str(constraint: str):
     return '^' + constraint + '$'
 
 # Each xval must match the corresponding positions in the crossing answers.
-def get_solutions(answers: List[List[str]], xvardatas: List[XvarData]):
-    for candidate in itertools.product(*answers):
-        for xvd in xvardatas:
-            if candidate[xvd.constraint0][xvd.pos0] != candidate[xvd.constraint1][xvd.pos1]:
-                break
-        else:
-            yield candidate
+def get_solutions(answers: List[List[str]], xvardatas: List[XvarData], stats: Optional[SearchStats] = None):
+    yield from SolutionSearch(answers, xvardatas, stats).solutions()
     return
 
+# Same solutions, in the same order, as get_solutions, but found by a pool of jobs processes.
+# The candidates for the first constraint to be assigned are split into chunks, which are
+# searched independently. The results are streamed back in chunk order.
+# Given a limit, each worker stops a chunk after limit solutions, as no more from one chunk can be needed,
+# so that the first solutions of a large search arrive as quickly as they would serially.
+# If the caller stops early, the pool is terminated, dropping both the queued and the running chunks.
+def get_solutions_parallel(answers: List[List[str]], xvardatas: List[XvarData], jobs: int,
+                           stats: Optional[SearchStats] = None, limit: Optional[int] = None):
+    if jobs <= 1:
+        yield from itertools.islice(get_solutions(answers, xvardatas, stats), limit)
+        return
+    search = SolutionSearch(answers, xvardatas, stats)
+    constraint_k = search.first_constraint()
+    if constraint_k is None:
+        yield from itertools.islice(search.solutions(), limit)
+        return
+    word_ks = from_bitset(search.domains[constraint_k]) if all(search.domains) else []
+    chunk_size = max(1, len(word_ks) // (jobs * CHUNKS_PER_JOB))
+    chunks = [word_ks[k:k + chunk_size] for k in range(0, len(word_ks), chunk_size)]
+    # Leaving the with block terminates the pool.
+    found = 0
+    with multiprocessing.Pool(jobs, initializer=_init_solutions_worker, initargs=(answers, xvardatas)) as pool:
+        for solns, nodes, pruned in pool.imap(functools.partial(_get_chunk_solutions, constraint_k, limit), chunks):
+            search.stats.add(nodes, pruned)
+            if limit is not None:
+                solns = solns[:limit - found]
+                found += len(solns)
+            yield from solns
+            if limit is not None and found >= limit:
+                return
+
+_worker_search: Optional['SolutionSearch'] = None
+
+def _init_solutions_worker(answers: List[List[str]], xvardatas: List[XvarData]):
+    global _worker_search
+    _worker_search = SolutionSearch(answers, xvardatas)
+
+def _get_chunk_solutions(constraint_k: int, limit: Optional[int],
+                         word_ks: List[int]) -> Tuple[List[Tuple[str, ...]], int, int]:
+    assert(_worker_search)
+    _worker_search.stats = SearchStats()
+    solns = list(itertools.islice(_worker_search.solutions_from(constraint_k, word_ks), limit))
+    return solns, _worker_search.stats.nodes, _worker_search.stats.pruned
+
 def get_xvardatas(constraints: List[str], xvars: List[int]):
     xvardatas: List[XvarData] = []
     for xvar_k in range(len(xvars)):
@@ -119,21 +230,701 @@ def is_scrabble_word(word):
 def is_xvardata_valid(x):
     return x.constraint0 >= 0 and x.pos0 >= 0 and x.constraint1 >= 0 and x.pos1 >= 0
 
-def main(words_file, constraints_file):
-    constraints = [line.rstrip().lower() for line in open(constraints_file, 'r').readlines()]
-    regexpr_strs = [get_regexpr_str(constraint) for constraint in constraints]
-    regexprs = [re.compile(s) for s in regexpr_strs]
-    with open(words_file, 'r') as f:
-        words = [word.replace('\n', '').rstrip() for word in f.readlines() if is_scrabble_word(word)]
+# Returns a bitset (as an int) with the given bit indices set.
+def to_bitset(indices: Iterable[int], size: int) -> int:
+    if size == 0:
+        return 0
+    flags = bytearray(b'0' * size)
+    for k in indices:
+        flags[k] = ord('1')
+    return int(flags[::-1], 2)
+
+# Returns the indices of the set bits of a bitset, in increasing order.
+def from_bitset(bits: int) -> List[int]:
+    flags = bin(bits)[:1:-1]
+    return [k for k, c in enumerate(flags) if c == '1']
+
+
+# Backtracking search for the solutions, assigning one answer at a time.
+# The domain of each constraint is a bitset over its candidate answers. When an answer is assigned,
+# the domains of the constraints that cross it are narrowed through each shared xvar, and a branch
+# is abandoned as soon as one of those domains becomes empty. The constraint with the smallest
+# domain is assigned next. The solutions found are the same as those of a Cartesian-product search.
+class SolutionSearch:
+    def __init__(self, answers: List[List[str]], xvardatas: List[XvarData], stats: Optional[SearchStats] = None):
+        self.answers = answers
+        self.stats = stats if stats is not None else SearchStats()
+        self.crossings: List[List[Tuple[int, int, int]]] = [[] for _ in answers]  # (pos, other constraint, other pos)
+        self.domains: List[int] = [to_bitset(range(len(words)), len(words)) for words in answers]
+        for xvd in xvardatas:
+            if xvd.constraint0 == xvd.constraint1:
+                # Both ends of the xvar are in the same answer, so it can be checked up front.
+                words = answers[xvd.constraint0]
+                self.domains[xvd.constraint0] &= to_bitset(
+                        (k for k, w in enumerate(words) if w[xvd.pos0] == w[xvd.pos1]), len(words))
+                continue
+            self.crossings[xvd.constraint0].append((xvd.pos0, xvd.constraint1, xvd.pos1))
+            self.crossings[xvd.constraint1].append((xvd.pos1, xvd.constraint0, xvd.pos0))
+
+        # letter_bits[k][pos][letter] is the bitset of answers to constraint k with that letter at that position.
+        self.letter_bits: List[Dict[int, Dict[str, int]]] = []
+        for constraint_k, words in enumerate(answers):
+            positions = {pos for (pos, _, _) in self.crossings[constraint_k]}
+            self.letter_bits.append({pos: self._get_letter_bits(words, pos) for pos in positions})
+
+    @staticmethod
+    def _get_letter_bits(words: List[str], pos: int) -> Dict[str, int]:
+        letter2indices: Dict[str, List[int]] = {}
+        for k, word in enumerate(words):
+            letter2indices.setdefault(word[pos], []).append(k)
+        return {letter: to_bitset(indices, len(words)) for letter, indices in letter2indices.items()}
+
+    def _narrow(self, constraint_k: int, word: str, assignment: List[Optional[int]], domains: List[int]):
+        """Return the domains left after assigning word to constraint_k, or None if one becomes empty."""
+        narrowed = list(domains)
+        for (pos, other_k, other_pos) in self.crossings[constraint_k]:
+            if assignment[other_k] is not None:
+                continue  # Already checked when the other answer was assigned
+            bits = narrowed[other_k] & self.letter_bits[other_k][other_pos].get(word[pos], 0)
+            if not bits:
+                return None
+            narrowed[other_k] = bits
+        return narrowed
+
+    def _extend(self, assignment: List[Optional[int]], domains: List[int]) -> Iterator[Tuple[str, ...]]:
+        unassigned = [k for k in range(len(assignment)) if assignment[k] is None]
+        if not unassigned:
+            yield tuple(self.answers[k][word_k] for k, word_k in enumerate(assignment))
+            return
+        constraint_k = min(unassigned, key=lambda k: domains[k].bit_count())
+        yield from self._assign(constraint_k, from_bitset(domains[constraint_k]), assignment, domains)
+
+    def _assign(self, constraint_k: int, word_ks: Iterable[int],
+                assignment: List[Optional[int]], domains: List[int]) -> Iterator[Tuple[str, ...]]:
+        words = self.answers[constraint_k]
+        for word_k in word_ks:
+            self.stats.nodes += 1
+            narrowed = self._narrow(constraint_k, words[word_k], assignment, domains)
+            if narrowed is None:
+                self.stats.pruned += 1
+                continue
+            assignment[constraint_k] = word_k
+            yield from self._extend(assignment, narrowed)
+        assignment[constraint_k] = None
+
+    def first_constraint(self) -> Optional[int]:
+        """Return the constraint that the search assigns first, or None if there are no constraints."""
+        if not self.answers:
+            return None
+        return min(range(len(self.answers)), key=lambda k: self.domains[k].bit_count())
+
+    def solutions(self) -> Iterator[Tuple[str, ...]]:
+        """With no constraints, the one solution is the empty one."""
+        if not all(self.domains):
+            return
+        yield from self._extend([None] * len(self.answers), self.domains)
+
+    def solutions_from(self, constraint_k: int, word_ks: Iterable[int]) -> Iterator[Tuple[str, ...]]:
+        """Return the solutions in which constraint_k is answered by one of the given candidates."""
+        if not all(self.domains):
+            return
+        word_ks = [k for k in word_ks if self.domains[constraint_k] >> k & 1]
+        yield from self._assign(constraint_k, word_ks, [None] * len(self.answers), self.domains)
+
+
+# Search for grid fills, which maintains arc consistency: after each assignment, the narrowing of one
+# domain is propagated through its crossings to others, until no domain changes.
+# The letters still possible at each crossing position of each answer are cached, keyed by domain,
+# as are the bitsets of the answers allowed by each set of letters. No answer is used twice in a fill.
+class FillSearch(SolutionSearch):
+    MAX_CACHED_LETTER_SETS = 1 << 16
+
+    def __init__(self, answers: List[List[str]], xvardatas: List[XvarData], stats: Optional[SearchStats] = None):
+        super().__init__(answers, xvardatas, stats)
+        self._letters_cache: Dict[Tuple[int, int], Tuple[int, int]] = {}  # (constraint, pos) -> (domain, letters)
+        self._letters_bits_cache: Dict[Tuple[int, int, int], int] = {}  # (constraint, pos, letters) -> bitset
+
+    def _get_letters(self, constraint_k: int, pos: int, domain: int) -> int:
+        """Return the letters at pos of the answers in domain, as a bitmask with bit 0 for 'A'."""
+        cached = self._letters_cache.get((constraint_k, pos))
+        if cached and cached[0] == domain:
+            return cached[1]
+        letters = 0
+        for letter, bits in self.letter_bits[constraint_k][pos].items():
+            if domain & bits:
+                letters |= 1 << (ord(letter) - ord('A'))
+        self._letters_cache[(constraint_k, pos)] = (domain, letters)
+        return letters
+
+    def _get_letters_bits(self, constraint_k: int, pos: int, letters: int) -> int:
+        """Return the bitset of the answers to constraint_k with one of the given letters at pos."""
+        key = (constraint_k, pos, letters)
+        bits = self._letters_bits_cache.get(key)
+        if bits is None:
+            if len(self._letters_bits_cache) >= FillSearch.MAX_CACHED_LETTER_SETS:
+                self._letters_bits_cache.clear()
+            bits = 0
+            for letter, letter_bits in self.letter_bits[constraint_k][pos].items():
+                if letters >> (ord(letter) - ord('A')) & 1:
+                    bits |= letter_bits
+            self._letters_bits_cache[key] = bits
+        return bits
+
+    def _narrow(self, constraint_k: int, word: str, assignment: List[Optional[int]], domains: List[int]):
+        for other_k, word_k in enumerate(assignment):
+            if word_k is not None and self.answers[other_k][word_k] == word:
+                return None
+        narrowed = super()._narrow(constraint_k, word, assignment, domains)
+        if narrowed is None:
+            return None
+        queue = [other_k for (_, other_k, _) in self.crossings[constraint_k] if assignment[other_k] is None]
+        queued = set(queue)
+        while queue:
+            changed_k = queue.pop()
+            queued.discard(changed_k)
+            for (pos, other_k, other_pos) in self.crossings[changed_k]:
+                if other_k == constraint_k or assignment[other_k] is not None:
+                    continue
+                letters = self._get_letters(changed_k, pos, narrowed[changed_k])
+                bits = narrowed[other_k] & self._get_letters_bits(other_k, other_pos, letters)
+                if bits == narrowed[other_k]:
+                    continue
+                if not bits:
+                    return None
+                narrowed[other_k] = bits
+                if other_k not in queued:
+                    queue.append(other_k)
+                    queued.add(other_k)
+        return narrowed
+
+
+# ----------------------------------------
+# Grids
+# A grid file has one line per row. '#' is a black square, a letter is a given letter,
+# and any other character (such as '.' or '*') is an empty square.
+
+GRID_BLACK = '#'
+
+# An across or down answer in a grid, numbered as in a printed crossword.
+@dataclass
+class Slot:
+    number: int
+    is_across: bool
+    row: int
+    col: int
+    length: int
+
+    def cells(self) -> List[Tuple[int, int]]:
+        if self.is_across:
+            return [(self.row, self.col + k) for k in range(self.length)]
+        return [(self.row + k, self.col) for k in range(self.length)]
+
+    def __str__(self):
+        return f'{self.number}-{"Across" if self.is_across else "Down"}'
+
+def read_grid(grid_file: str) -> List[str]:
+    with open(grid_file, 'r') as f:
+        rows = [line.rstrip('\n') for line in f.readlines() if line.strip()]
+    width = max(map(len, rows), default=0)
+    return [row.ljust(width, GRID_BLACK) for row in rows]
+
+def get_grid_slots(grid: List[str]) -> List[Slot]:
+    """Return the across and down answers (of two or more letters) in grid, in order of number."""
+    def is_open(row, col):
+        return 0 <= row < len(grid) and 0 <= col < len(grid[row]) and grid[row][col] != GRID_BLACK
+
+    def run_length(row, col, drow, dcol):
+        length = 0
+        while is_open(row + length * drow, col + length * dcol):
+            length += 1
+        return length
+
+    slots: List[Slot] = []
+    number = 0
+    for row in range(len(grid)):
+        for col in range(len(grid[row])):
+            if not is_open(row, col):
+                continue
+            across_length = run_length(row, col, 0, 1) if not is_open(row, col - 1) else 0
+            down_length = run_length(row, col, 1, 0) if not is_open(row - 1, col) else 0
+            if across_length < 2 and down_length < 2:
+                continue
+            number += 1
+            if across_length >= 2:
+                slots.append(Slot(number, True, row, col, across_length))
+            if down_length >= 2:
+                slots.append(Slot(number, False, row, col, down_length))
+    return slots
+
+def get_grid_constraints(grid: List[str], slots: List[Slot]) -> List[str]:
+    def cell_constraint(c):
+        return c.lower() if c in string.ascii_letters else '*'
+    return [''.join(cell_constraint(grid[row][col]) for (row, col) in slot.cells()) for slot in slots]
+
+def get_grid_xvardatas(slots: List[Slot]) -> List[XvarData]:
+    """Return one xvar for each square shared by an across answer and a down answer."""
+    across_cells: Dict[Tuple[int, int], Tuple[int, int]] = {}  # cell -> (slot, pos)
+    for slot_k, slot in enumerate(slots):
+        if slot.is_across:
+            for pos, cell in enumerate(slot.cells()):
+                across_cells[cell] = (slot_k, pos)
+    xvardatas: List[XvarData] = []
+    for slot_k, slot in enumerate(slots):
+        if not slot.is_across:
+            for pos, cell in enumerate(slot.cells()):
+                if cell in across_cells:
+                    xvardatas.append(XvarData(*across_cells[cell], slot_k, pos))
+    return xvardatas
+
+def get_filled_grid(grid: List[str], slots: List[Slot], soln: Tuple[str, ...]) -> List[str]:
+    rows = [list(row) for row in grid]
+    for slot, answer in zip(slots, soln):
+        for (row, col), c in zip(slot.cells(), answer):
+            rows[row][col] = c
+    return [''.join(row) for row in rows]
+
+
+# Returns the number of solutions, without enumerating them.
+# Only the letters at xvar positions matter to the crossings, so the answers to each constraint are
+# grouped by those letters, and the search runs over the groups, multiplying their sizes.
+# Groups of constraints that do not cross each other are counted separately, and their counts multiplied.
+def count_solutions(answers: List[List[str]], xvardatas: List[XvarData], stats: Optional[SearchStats] = None) -> int:
+    neighbors: List[Set[int]] = [set() for _ in answers]
+    for xvd in xvardatas:
+        neighbors[xvd.constraint0].add(xvd.constraint1)
+        neighbors[xvd.constraint1].add(xvd.constraint0)
+    result = 1
+    unvisited = set(range(len(answers)))
+    while unvisited and result:
+        component = {unvisited.pop()}
+        frontier = list(component)
+        while frontier:
+            for other_k in neighbors[frontier.pop()] - component:
+                component.add(other_k)
+                frontier.append(other_k)
+        unvisited -= component
+        result *= _count_component_solutions(answers, xvardatas, sorted(component), stats)
+    return result
+
+def _count_component_solutions(answers: List[List[str]], xvardatas: List[XvarData], component: List[int],
+                               stats: Optional[SearchStats]) -> int:
+    component_xvardatas = [xvd for xvd in xvardatas if xvd.constraint0 in component]
+    positions: Dict[int, List[int]] = {constraint_k: [] for constraint_k in component}
+    for xvd in component_xvardatas:
+        positions[xvd.constraint0].append(xvd.pos0)
+        positions[xvd.constraint1].append(xvd.pos1)
+    positions = {constraint_k: sorted(set(ps)) for constraint_k, ps in positions.items()}
+
+    # Each group is represented by the string of its letters at the xvar positions.
+    group_sizes = [Counter(''.join(word[pos] for pos in positions[constraint_k]) for word in answers[constraint_k])
+                   for constraint_k in component]
+    group_answers = [list(sizes) for sizes in group_sizes]
+    new_k = {constraint_k: k for k, constraint_k in enumerate(component)}
+    group_xvardatas = [XvarData(new_k[xvd.constraint0], positions[xvd.constraint0].index(xvd.pos0),
+                                new_k[xvd.constraint1], positions[xvd.constraint1].index(xvd.pos1))
+                       for xvd in component_xvardatas]
+    return sum(math.prod(sizes[group] for sizes, group in zip(group_sizes, soln))
+               for soln in get_solutions(group_answers, group_xvardatas, stats))
+
+
+def parse_wordlist_line(line: str) -> Optional[Tuple[str, int]]:
+    """Return the word and score on a wordlist line, or None if it has no usable word."""
+    word, _, score = line.partition(';')
+    word = word.rstrip()
+    if not word or not is_scrabble_word(word):
+        return None
+    try:
+        return word, int(score) if score.strip() else DEFAULT_WORD_SCORE
+    except ValueError:
+        return None
+
+
+# Index of a wordlist keyed by (word length, position, letter), memory-mapped from a cache file.
+# The index is built once per wordlist and rebuilt when the wordlist's contents change.
+# Finding the words that match a constraint takes one bitset intersection per fixed letter.
+class WordIndex:
+    def __init__(self, index_path: str):
+        with open(index_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, _, _, length_count = INDEX_HEADER.unpack_from(self.mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f'WordIndex: Not a word index file: {index_path}')
+        self.entries: Dict[int, Tuple[int, int, int]] = {}  # length -> (word count, words offset, bitsets offset)
+        self.scores_offsets: Dict[int, int] = {}
+        for k in range(length_count):
+            length, count, words_offset, scores_offset, bitsets_offset = INDEX_ENTRY.unpack_from(
+                    self.mm, INDEX_HEADER.size + k * INDEX_ENTRY.size)
+            self.entries[length] = (count, words_offset, bitsets_offset)
+            self.scores_offsets[length] = scores_offset
+
+    @staticmethod
+    def build(words_file: str, index_path: str) -> None:
+        with open(words_file, 'rb') as f:
+            data = f.read()
+        stat = os.stat(words_file)
+        word2score: Dict[str, int] = {}
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            entry = parse_wordlist_line(line)
+            if entry:
+                word, score = entry
+                word2score[word] = max(score, word2score.get(word, score))
+        length2words: Dict[int, List[str]] = {}
+        for word in sorted(word2score, key=lambda w: (-word2score[w], w)):
+            length2words.setdefault(len(word), []).append(word)
+
+        lengths = sorted(length2words)
+        offset = INDEX_HEADER.size + len(lengths) * INDEX_ENTRY.size
+        entries, blobs = [], []
+        for length in lengths:
+            words = length2words[length]
+            words_blob = ''.join(words).encode('ascii')
+            scores_blob = np.array([word2score[w] for w in words], dtype='<i4').tobytes()
+            bitsets_blob = b''.join(bits.to_bytes(_bitset_nbytes(len(words)), 'little')
+                                    for pos in range(length)
+                                    for bits in WordIndex._get_position_bits(words, pos))
+            scores_offset = offset + len(words_blob)
+            entries.append(INDEX_ENTRY.pack(length, len(words), offset, scores_offset, scores_offset + len(scores_blob)))
+            blobs += [words_blob, scores_blob, bitsets_blob]
+            offset += len(words_blob) + len(scores_blob) + len(bitsets_blob)
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, stat.st_mtime_ns, stat.st_size,
+                                   hashlib.sha1(data).digest(), len(lengths))
+
+        # Write to a temporary file and rename it, so that a concurrent reader never sees a partial index.
+        index_dir = os.path.dirname(index_path) or '.'
+        os.makedirs(index_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.writelines(entries)
+            f.writelines(blobs)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def _get_position_bits(words: List[str], pos: int) -> List[int]:
+        letter2indices: Dict[str, List[int]] = {letter: [] for letter in string.ascii_lowercase}
+        for k, word in enumerate(words):
+            letter2indices[word[pos]].append(k)
+        return [to_bitset(letter2indices[letter], len(words)) for letter in string.ascii_lowercase]
+
+    @staticmethod
+    def get_index_path(words_file: str, cache_dir: str) -> str:
+        key = hashlib.sha1(os.path.abspath(words_file).encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, f'{os.path.basename(words_file)}.{key}.idx')
+
+    @staticmethod
+    def is_current(words_file: str, index_path: str) -> bool:
+        """Return whether the index at index_path was built from the current contents of words_file."""
+        try:
+            with open(index_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+        except FileNotFoundError:
+            return False
+        if len(header) < INDEX_HEADER.size:
+            return False
+        magic, version, mtime_ns, size, sha1, length_count = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            return False
+        stat = os.stat(words_file)
+        if stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+            return True
+        if stat.st_size != size:
+            return False
+        with open(words_file, 'rb') as words_f:
+            if hashlib.sha1(words_f.read()).digest() != sha1:
+                return False
+        # The wordlist was touched but not changed. Record the new mtime, to skip hashing next time,
+        # unless the cache is read-only, in which case the index is still current.
+        try:
+            with open(index_path, 'r+b') as f:
+                f.write(INDEX_HEADER.pack(magic, version, stat.st_mtime_ns, size, sha1, length_count))
+        except OSError:
+            pass
+        return True
+
+    @classmethod
+    def load(cls, words_file: str, cache_dir: str = DEFAULT_CACHE_DIR) -> 'WordIndex':
+        index_path = cls.get_index_path(words_file, cache_dir)
+        if not cls.is_current(words_file, index_path):
+            cls.build(words_file, index_path)
+        return cls(index_path)
+
+    def letter_bits(self, length: int, pos: int, letter: str) -> int:
+        """Return the bitset of the words with the given length that have letter at pos."""
+        count, _, bitsets_offset = self.entries[length]
+        nbytes = _bitset_nbytes(count)
+        start = bitsets_offset + (pos * 26 + ord(letter) - ord('a')) * nbytes
+        return int.from_bytes(self.mm[start:start + nbytes], 'little')
+
+    def matching(self, constraint: str) -> List[str]:
+        """Return the words that match constraint, in which letters are fixed and all else is free."""
+        return matrix_to_words(self.matching_matrix(constraint))
+
+    def matching_matrix(self, constraint: str) -> NDArray:
+        """Return the letter matrix of the words that match constraint."""
+        return self.matrix(len(constraint))[self.matching_rows(constraint)]
+
+    def matching_rows(self, constraint: str) -> NDArray:
+        """Return the indices of the words that match constraint, among the words of its length."""
+        length = len(constraint)
+        count, _, bitsets_offset = self.entries.get(length, (0, 0, 0))
+        nbytes = _bitset_nbytes(count)
+        bits = None
+        for pos, c in enumerate(constraint):
+            if c in string.ascii_lowercase:
+                start = bitsets_offset + (pos * 26 + ord(c) - ord('a')) * nbytes
+                letter_bits = np.frombuffer(self.mm, dtype=np.uint8, count=nbytes, offset=start)
+                bits = letter_bits if bits is None else bits & letter_bits
+        if bits is None:
+            return np.arange(count)
+        return np.flatnonzero(np.unpackbits(bits, count=count, bitorder='little'))
+
+    def matrix(self, length: int) -> NDArray:
+        """Return the words with the given length as a (word count, length) matrix of ASCII codes.
+        The matrix is a read-only view of the memory-mapped index.
+        """
+        count, words_offset, _ = self.entries.get(length, (0, 0, 0))
+        if not count:
+            return np.zeros((0, length), dtype=np.uint8)
+        return np.frombuffer(self.mm, dtype=np.uint8, count=count * length, offset=words_offset).reshape(count, length)
+
+    def scores(self, length: int) -> NDArray:
+        count = self.entries.get(length, (0, 0, 0))[0]
+        if not count:
+            return np.zeros(0, dtype='<i4')
+        return np.frombuffer(self.mm, dtype='<i4', count=count, offset=self.scores_offsets[length])
+
+    def word(self, length: int, k: int) -> str:
+        start = self.entries[length][1] + k * length
+        return self.mm[start:start + length].decode('ascii')
+
+    def words(self, length: int) -> List[str]:
+        count, words_offset, _ = self.entries.get(length, (0, 0, 0))
+        blob = self.mm[words_offset:words_offset + count * length].decode('ascii')
+        return [blob[k:k + length] for k in range(0, len(blob), length)]
+
+
+def _bitset_nbytes(size: int) -> int:
+    return (size + 7) // 8
+
+def matrix_to_words(matrix: NDArray) -> List[str]:
+    length = matrix.shape[1]
+    if not length:
+        return []
+    blob = matrix.tobytes().decode('ascii')
+    return [blob[k:k + length] for k in range(0, len(blob), length)]
+
+# Several wordlists (e.g., a dictionary, theme words and theme phrases) searched as one.
+# Each wordlist has its own cached index, so editing one wordlist rebuilds only its index.
+# Words found in several wordlists are merged, keeping the highest score and, among equal scores,
+# the first wordlist (the source). Matching words are returned from highest to lowest score.
+class WordLists:
+    def __init__(self, indexes: List[WordIndex]):
+        self.indexes = indexes
+
+    @classmethod
+    def load(cls, words_files: List[str], cache_dir: str = DEFAULT_CACHE_DIR) -> 'WordLists':
+        return cls([WordIndex.load(words_file, cache_dir) for words_file in words_files])
+
+    def matching(self, constraint: str) -> List[str]:
+        return matrix_to_words(self.matching_matrix(constraint))
+
+    def matching_matrix(self, constraint: str) -> NDArray:
+        return self.matching_entries(constraint)[0]
+
+    def matching_entries(self, constraint: str) -> Tuple[NDArray, NDArray, NDArray]:
+        """Return the letter matrix, scores and sources (wordlist numbers) of the words that match constraint."""
+        length = len(constraint)
+        matrices, scores, sources = [], [], []
+        for source, index in enumerate(self.indexes):
+            rows = index.matching_rows(constraint)
+            matrices.append(index.matrix(length)[rows])
+            scores.append(index.scores(length)[rows])
+            sources.append(np.full(len(rows), source, dtype=np.int32))
+        if len(self.indexes) == 1:
+            return matrices[0], scores[0], sources[0]
+        matrix = np.concatenate(matrices) if matrices else np.zeros((0, length), dtype=np.uint8)
+        score = np.concatenate(scores) if scores else np.zeros(0, dtype=np.int32)
+        source = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int32)
+        if not len(matrix) or not length:
+            return matrix, score, source
+        # Sort by word, best entry first, then keep the first entry for each word.
+        words = np.ascontiguousarray(matrix).view(f'S{length}').ravel()
+        order = np.lexsort((source, -score, words))
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = words[order[1:]] != words[order[:-1]]
+        kept = order[is_first]
+        kept = kept[np.lexsort((words[kept], -score[kept]))]
+        return matrix[kept], score[kept], source[kept]
+
+
+# Removes the candidates that cannot be part of any solution, because no candidate for a crossing
+# answer has the same letter at the crossing. Each crossing is checked as a join of two letter columns,
+# through a lookup table of the letters present in one of them. Repeats until nothing more is removed.
+def prune_candidates(matrices: List[NDArray], xvardatas: List[XvarData]) -> List[NDArray]:
+    matrices = list(matrices)
+    crossings = []
+    for xvd in xvardatas:
+        if xvd.constraint0 == xvd.constraint1:
+            matrix = matrices[xvd.constraint0]
+            matrices[xvd.constraint0] = matrix[matrix[:, xvd.pos0] == matrix[:, xvd.pos1]]
+        else:
+            crossings += [(xvd.constraint0, xvd.pos0, xvd.constraint1, xvd.pos1),
+                          (xvd.constraint1, xvd.pos1, xvd.constraint0, xvd.pos0)]
+    is_changed = True
+    while is_changed:
+        is_changed = False
+        for (constraint_k, pos, other_k, other_pos) in crossings:
+            is_present = np.zeros(256, dtype=bool)
+            is_present[matrices[other_k][:, other_pos]] = True
+            is_kept = is_present[matrices[constraint_k][:, pos]]
+            if not is_kept.all():
+                matrices[constraint_k] = matrices[constraint_k][is_kept]
+                is_changed = True
+    return matrices
+
+
+def read_constraints(constraints_file: str) -> List[str]:
+    with open(constraints_file, 'r') as f:
+        return [line.rstrip().lower() for line in f.readlines()]
+
+# Each answer (one per constraint) must be in a wordlist and match the corresponding constraint.
+# Candidates that cannot match any candidate for a crossing answer are dropped before the search.
+def get_answers(word_lists: WordLists, constraints: List[str], xvardatas: List[XvarData]) -> List[List[str]]:
+    matrices = prune_candidates([word_lists.matching_matrix(constraint) for constraint in constraints], xvardatas)
+    return [matrix_to_words(matrix - np.uint8(ord('a') - ord('A'))) for matrix in matrices]
+
+# Solves one constraint set, and returns the results as a dict, for JSON output.
+def solve_puzzle(word_lists: WordLists, name: str, constraints: List[str],
+                 count=False, limit=None, exists=False, show_stats=False) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result: Dict[str, Any] = {'puzzle': name}
+    try:
+        xvars = get_xvars(constraints)
+    except ValueError as ex:
+        result['error'] = str(ex)
+    else:
+        xvardatas = get_xvardatas(constraints, xvars)
+        answers = get_answers(word_lists, constraints, xvardatas)
+        stats = SearchStats([len(words) for words in answers])
+        search_start = time.perf_counter()
+        if count:
+            result['count'] = count_solutions(answers, xvardatas, stats)
+        elif exists:
+            result['exists'] = next(get_solutions(answers, xvardatas, stats), None) is not None
+        else:
+            solns = get_solutions(answers, xvardatas, stats)
+            result['solutions'] = [list(soln) for soln in itertools.islice(solns, limit)]
+        stats.seconds = time.perf_counter() - search_start
+        if show_stats:
+            result['stats'] = stats.as_dict()
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+# As solve_puzzle, for the constraints in the file at path. A file that cannot be read gives an error result.
+def solve_puzzle_file(word_lists: WordLists, path: str,
+                      count=False, limit=None, exists=False, show_stats=False) -> Dict[str, Any]:
+    try:
+        constraints = read_constraints(path)
+    except (OSError, UnicodeDecodeError) as ex:
+        return {'puzzle': path, 'error': str(ex)}
+    return solve_puzzle(word_lists, path, constraints, count, limit, exists, show_stats)
+
+_worker_word_lists: Optional[WordLists] = None
+
+def _init_batch_worker(words_files: List[str], cache_dir: str):
+    global _worker_word_lists
+    _worker_word_lists = WordLists.load(words_files, cache_dir)
+
+def _solve_batch_puzzle(solve, *args):
+    assert(_worker_word_lists)
+    return solve(_worker_word_lists, *args)
+
+# Solves many constraint sets against the wordlists, loaded once, printing one JSON object per line.
+# The constraint sets are read from puzzle_files, or else from stdin, one set per line,
+# with constraints separated by whitespace. Up to jobs puzzles are solved at once.
+# Each puzzle file is read when its puzzle is solved, so one that cannot be read gives only its own error result.
+def main_batch(words_files, puzzle_files, cache_dir=DEFAULT_CACHE_DIR, jobs=1, count=False, limit=None, exists=False,
+               show_stats=False):
+    word_lists = WordLists.load(words_files, cache_dir)
+    if puzzle_files:
+        solve, puzzles = solve_puzzle_file, [list(puzzle_files)]
+    else:
+        lines = [(f'<stdin>:{k+1}', line.lower().split()) for k, line in enumerate(sys.stdin) if line.strip()]
+        solve, puzzles = solve_puzzle, [[name for name, _ in lines], [constraints for _, constraints in lines]]
+    options = [[option] * len(puzzles[0]) for option in [count, limit, exists, show_stats]]
+    if jobs <= 1:
+        results: Iterable[Dict[str, Any]] = map(functools.partial(solve, word_lists), *puzzles, *options)
+        for result in results:
+            print(json.dumps(result), flush=True)
+        return
+    # The workers load the index from the cache file written above, so they share its mapped pages.
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(words_files, cache_dir)) as executor:
+        for result in executor.map(functools.partial(_solve_batch_puzzle, solve), *puzzles, *options):
+            print(json.dumps(result), flush=True)
+
+# Fills a grid, printing up to limit fills (one by default), or only whether a fill exists.
+def main_grid(words_files, grid_file, cache_dir=DEFAULT_CACHE_DIR, limit=None, exists=False, show_stats=False):
+    grid = read_grid(grid_file)
+    word_lists = WordLists.load(words_files, cache_dir)
+    slots = get_grid_slots(grid)
+    constraints = get_grid_constraints(grid, slots)
+    xvardatas = get_grid_xvardatas(slots)
+    answers = get_answers(word_lists, constraints, xvardatas)
+    stats = SearchStats([len(words) for words in answers])
+    start = time.perf_counter()
+    limit = 1 if exists or limit is None else limit
+    found = 0
+    for k, soln in enumerate(itertools.islice(FillSearch(answers, xvardatas, stats).solutions(), limit)):
+        found += 1
+        if not exists:
+            print(f'Fill #{k+1}:')
+            for row in get_filled_grid(grid, slots, soln):
+                print(f'    {row}')
+            for slot, answer in zip(slots, soln):
+                print(f'  {str(slot):>10}: {answer}')
+    if exists:
+        print(f'Fill exists: {found > 0}')
+    stats.seconds = time.perf_counter() - start
+    if show_stats:
+        print(stats, file=sys.stderr)
+
+def main(words_files, constraints_file, cache_dir=DEFAULT_CACHE_DIR, jobs=1, count=False, limit=None, exists=False,
+         show_stats=False):
+    constraints = read_constraints(constraints_file)
+    word_lists = WordLists.load(words_files, cache_dir)
     xvars = get_xvars(constraints)
 
-    # Each answer (one per constraint) must be in the wordlist and match the corresponding constraint.
-    answers = [[w.upper() for w in words if re.search(regexprs[k], w)]
-                  for k in range(len(constraints))
-              ]
     xvardatas = get_xvardatas(constraints, xvars)
-    for k, soln in enumerate(get_solutions(answers, xvardatas)):
-        print(f'Solution #{k+1:2}: {soln}')
+    answers = get_answers(word_lists, constraints, xvardatas)
+    stats = SearchStats([len(words) for words in answers])
+    start = time.perf_counter()
+    if count:
+        print(f'Solution count: {count_solutions(answers, xvardatas, stats)}')
+    else:
+        if exists:
+            limit = 1
+        with closing(get_solutions_parallel(answers, xvardatas, jobs, stats, limit)) as solns:
+            found = 0
+            for k, soln in enumerate(itertools.islice(solns, limit)):
+                found += 1
+                if not exists:
+                    print(f'Solution #{k+1:2}: {soln}')
+        if exists:
+            print(f'Solution exists: {found > 0}')
+    stats.seconds = time.perf_counter() - start
+    if show_stats:
+        print(stats, file=sys.stderr)
+
+
+def non_negative_int(s: str) -> int:
+    try:
+        value = int(s)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise argparse.ArgumentTypeError(f'Must be a non-negative integer: {s}')
+    return value
 
 
 class TestXwordFunctions(unittest.TestCase):
@@ -145,31 +936,220 @@ class TestXwordFunctions(unittest.TestCase):
         xvardatas = [XvarData(0, 3, 1, 1)]
         self.assertTrue(get_solutions(answers, xvardatas), [['tidal', 'wave']])
 
+    def test_get_solutions_matches_product(self):
+        answers = [['LUKEWARM', 'LAKEWARM', 'LIKEWISE'],
+                   ['NEUTRINO', 'NAUTRINO', 'NEUTRONS'],
+                   ['DUNGAREE', 'DANGAREE', 'DINGEREE'],
+                   ['FRACKING', 'FRECKING', 'FRACKINO']]
+        xvardatas = get_xvardatas(['L1....2M', 'N3....4O', 'D1....3E', 'F2.C..4G'], ['1', '2', '3', '4'])
+        expected = {c for c in itertools.product(*answers)
+                      if all(c[x.constraint0][x.pos0] == c[x.constraint1][x.pos1] for x in xvardatas)}
+        actual = list(get_solutions(answers, xvardatas))
+        self.assertEqual(len(actual), len(expected))
+        self.assertEqual(set(actual), expected)
+        self.assertIn(('LUKEWARM', 'NEUTRINO', 'DUNGAREE', 'FRACKING'), expected)
+
+    def test_get_solutions_empty_domain(self):
+        answers = [['TIDAL'], []]
+        self.assertEqual(list(get_solutions(answers, [XvarData(0, 3, 1, 1)])), [])
+
+    def test_get_solutions_parallel(self):
+        answers = [['TIDAL', 'TOTAL', 'TEXAS', 'TONAL', 'TUBAL'], ['WAVE', 'WHEN', 'WAXY', 'WOKE']]
+        xvardatas = [XvarData(0, 3, 1, 1)]
+        expected = list(get_solutions(answers, xvardatas))
+        self.assertEqual(list(get_solutions_parallel(answers, xvardatas, 2)), expected)
+        self.assertEqual(len(expected), 10)
+        with closing(get_solutions_parallel(answers, xvardatas, 2)) as solns:
+            self.assertEqual(list(itertools.islice(solns, 3)), expected[:3])
+        for limit in [0, 1, 3, 20]:
+            self.assertEqual(list(get_solutions_parallel(answers, xvardatas, 2, limit=limit)), expected[:limit])
+
+    def test_chunk_solutions_limit(self):
+        answers = [['TIDAL', 'TOTAL', 'TEXAS'], ['WAVE', 'WHEN', 'WAXY', 'WOKE'], ['ABC', 'DEF']]
+        _init_solutions_worker(answers, [])
+        solns, nodes, _ = _get_chunk_solutions(0, 2, [0, 1, 2])
+        self.assertEqual(solns, list(itertools.islice(get_solutions(answers, []), 2)))
+        self.assertLess(nodes, 3 + 3 * 4 + 3 * 4 * 2)
+
+    def test_count_solutions(self):
+        answers = [['TIDAL', 'TOTAL', 'TEXAS', 'TONAL', 'TUBAL'], ['WAVE', 'WHEN', 'WAXY', 'WOKE'], ['ABC', 'DEF']]
+        xvardatas = [XvarData(0, 3, 1, 1)]
+        self.assertEqual(count_solutions(answers, xvardatas), len(list(get_solutions(answers, xvardatas))))
+        self.assertEqual(count_solutions(answers, xvardatas), 20)
+        self.assertEqual(count_solutions(answers[:2] + [[]], xvardatas), 0)
+
+    def test_no_constraints(self):
+        self.assertEqual(list(get_solutions([], [])), [()])
+        self.assertEqual(list(get_solutions_parallel([], [], 2)), [()])
+        self.assertEqual(count_solutions([], []), 1)
+        self.assertIsNone(SolutionSearch([], []).first_constraint())
+
+    def test_search_stats(self):
+        answers = [['TIDAL', 'TOTAL', 'TEXAS', 'TONAL', 'TUBAL'], ['WAVE', 'WHEN', 'WAXY', 'WOKE']]
+        xvardatas = [XvarData(0, 3, 1, 1)]
+        stats = SearchStats()
+        self.assertEqual(len(list(get_solutions(answers, xvardatas, stats))), 10)
+        self.assertEqual((stats.nodes, stats.pruned), (4 + 2 * 5, 2))
+        parallel_stats = SearchStats()
+        list(get_solutions_parallel(answers, xvardatas, 2, parallel_stats))
+        self.assertEqual((parallel_stats.nodes, parallel_stats.pruned), (stats.nodes, stats.pruned))
+
+    def test_bitset_round_trip(self):
+        self.assertEqual(from_bitset(to_bitset([0, 3, 64, 65], 70)), [0, 3, 64, 65])
+        self.assertEqual(from_bitset(0), [])
+
+    def test_word_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            words_file = os.path.join(tmp_dir, 'words')
+            with open(words_file, 'w') as f:
+                f.write('tidal\nwave\ntotal\nTexas\nwhen\ntidal\n')
+            index = WordIndex.load(words_file, tmp_dir)
+            self.assertEqual(index.matching('t**3*'), ['tidal', 'total'])
+            self.assertEqual(index.matching('w3**'), ['wave', 'when'])
+            self.assertEqual(index.matching('x**'), [])
+            self.assertEqual(index.words(5), ['tidal', 'total'])
+
+            index_path = WordIndex.get_index_path(words_file, tmp_dir)
+            self.assertTrue(WordIndex.is_current(words_file, index_path))
+            with open(words_file, 'a') as f:
+                f.write('tonal\n')
+            self.assertFalse(WordIndex.is_current(words_file, index_path))
+            self.assertEqual(WordIndex.load(words_file, tmp_dir).matching('t*n**'), ['tonal'])
+
+    def test_word_index_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            words_file = os.path.join(tmp_dir, 'words')
+            with open(words_file, 'w') as f:
+                f.write('tidal\nwave\n')
+            index_path = WordIndex.get_index_path(words_file, tmp_dir)
+            WordIndex.build(words_file, index_path)
+            os.chmod(index_path, 0o444)
+            stat = os.stat(words_file)
+            os.utime(words_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertTrue(WordIndex.is_current(words_file, index_path))
+            self.assertEqual(WordIndex.load(words_file, tmp_dir).matching('w***'), ['wave'])
+
+    def test_solve_puzzle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            words_file = os.path.join(tmp_dir, 'words')
+            with open(words_file, 'w') as f:
+                f.write('tidal\nwave\ntotal\nwhen\n')
+            index = WordLists.load([words_file], tmp_dir)
+            result = solve_puzzle(index, 'example1', ['t**3*', 'w3**'])
+            self.assertEqual(result['solutions'], [['TIDAL', 'WAVE'], ['TOTAL', 'WAVE']])
+            self.assertEqual(solve_puzzle(index, 'example1', ['t**3*', 'w3**'], count=True)['count'], 2)
+            self.assertIn('error', solve_puzzle(index, 'bad', ['t**3*', 'w***']))
+
+            puzzle_file = os.path.join(tmp_dir, 'example1.puz')
+            with open(puzzle_file, 'w') as f:
+                f.write('t**3*\nw3**\n')
+            self.assertEqual(solve_puzzle_file(index, puzzle_file)['solutions'], [['TIDAL', 'WAVE'], ['TOTAL', 'WAVE']])
+            missing = os.path.join(tmp_dir, 'missing.puz')
+            self.assertEqual(set(solve_puzzle_file(index, missing)), {'puzzle', 'error'})
+
+    def test_prune_candidates(self):
+        matrices = [np.frombuffer(b'tidaltotaltexas', dtype=np.uint8).reshape(3, 5),
+                    np.frombuffer(b'wavewhenwoke', dtype=np.uint8).reshape(3, 4)]
+        pruned = prune_candidates(matrices, [XvarData(0, 3, 1, 1)])
+        self.assertEqual([matrix_to_words(m) for m in pruned], [['tidal', 'total', 'texas'], ['wave']])
+        pruned = prune_candidates(matrices, [XvarData(0, 1, 1, 1)])
+        self.assertEqual([matrix_to_words(m) for m in pruned], [['total'], ['woke']])
+
+    def test_get_grid_slots(self):
+        grid = ['#..', '...', '..#']
+        slots = get_grid_slots(grid)
+        self.assertEqual([str(slot) for slot in slots], ['1-Across', '1-Down', '2-Down', '3-Across', '3-Down', '4-Across'])
+        self.assertEqual(get_grid_constraints(grid, slots), ['**', '***', '**', '***', '**', '**'])
+        self.assertEqual(len(get_grid_xvardatas(slots)), 7)
+
+    def test_fill_search(self):
+        grid = ['...', '...', '...']
+        slots = get_grid_slots(grid)
+        xvardatas = get_grid_xvardatas(slots)
+        words = ['CAT', 'ORE', 'WED', 'COW', 'ARE', 'TED']
+        solns = list(FillSearch([words] * len(slots), xvardatas).solutions())
+        self.assertEqual([get_filled_grid(grid, slots, soln) for soln in solns],
+                         [['CAT', 'ORE', 'WED'], ['COW', 'ARE', 'TED']])
+        self.assertEqual(len(list(get_solutions([words] * len(slots), xvardatas))), 4)  # Allows repeated words
+
+    def test_word_lists(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dict_file = os.path.join(tmp_dir, 'dict')
+            theme_file = os.path.join(tmp_dir, 'theme')
+            with open(dict_file, 'w') as f:
+                f.write('tidal;20\ntotal\ntonal;10\nwave\n')
+            with open(theme_file, 'w') as f:
+                f.write('tonal;90\ntubal;60\nbad entry;x\n')
+            index = WordIndex.load(dict_file, tmp_dir)
+            self.assertEqual(index.matching('t****'), ['total', 'tidal', 'tonal'])
+            self.assertEqual(list(index.scores(5)), [50, 20, 10])
+
+            word_lists = WordLists.load([dict_file, theme_file], tmp_dir)
+            matrix, scores, sources = word_lists.matching_entries('t****')
+            self.assertEqual(matrix_to_words(matrix), ['tonal', 'tubal', 'total', 'tidal'])
+            self.assertEqual(list(scores), [90, 60, 50, 20])
+            self.assertEqual(list(sources), [1, 1, 0, 0])
+
+            # Editing the theme list leaves the dictionary's index as it was.
+            dict_index_mtime = os.stat(WordIndex.get_index_path(dict_file, tmp_dir)).st_mtime_ns
+            with open(theme_file, 'a') as f:
+                f.write('tidal;95\n')
+            word_lists = WordLists.load([dict_file, theme_file], tmp_dir)
+            self.assertEqual(word_lists.matching('t****'), ['tidal', 'tonal', 'tubal', 'total'])
+            self.assertEqual(os.stat(WordIndex.get_index_path(dict_file, tmp_dir)).st_mtime_ns, dict_index_mtime)
+
     def test_get_xvardatas(self):
         self.assertTrue(get_xvardatas(['T**3*', 'W3**'], [3]), [XvarData(0, 3, 1, 1)])
 
     def test_get_xvars(self):
         self.assertTrue(get_xvardatas(['T**3*', 'W3**'], [3]))
 
+    def test_non_negative_int(self):
+        self.assertEqual(non_negative_int('0'), 0)
+        self.assertEqual(non_negative_int('12'), 12)
+        for s in ['-1', 'x', '']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                non_negative_int(s)
+
 
-# TODO: Modify to allow multiple wordlists (e.g., standard dictionary + theme words + theme phrases)
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
             description='Allow user to specify constraints and word files for crossword puzzles .\n' + XWORD_HELP,
             formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-b', '--batch', type=str, nargs='*',
+            help='Solve each of these constraints files (or each line of stdin, if none), printing JSON Lines')
     parser.add_argument('-c', '--constraints', type=str,
             help='Specify path of constraints file [Default is ./constraints.puz]')
-    parser.add_argument('-w', '--words', type=str,
-            help='Specify path of words file')
+    parser.add_argument('-w', '--words', type=str, action='append',
+            help='Specify path of words file; repeat to search several wordlists [Default is /usr/share/dict/words]')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+            help=f'Specify directory of cached word indexes [Default is {DEFAULT_CACHE_DIR}]')
+    parser.add_argument('-g', '--grid', type=str,
+            help='Specify path of a grid file to fill, instead of a constraints file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+            help='Specify number of processes used to search for solutions [Default is 1]')
+    parser.add_argument('--count', action='store_true',
+            help='Print only the number of solutions')
+    parser.add_argument('--limit', type=non_negative_int,
+            help='Stop after printing this many solutions')
+    parser.add_argument('--exists', action='store_true',
+            help='Print only whether any solution exists')
+    parser.add_argument('--stats', action='store_true',
+            help='Print search statistics (to stderr, or in each JSON result with --batch)')
     parser.add_argument('-t', '--tests', action='store_true',
-            help='Run unit tests before finding solutions [Default is /usr/share/dict/words]')
+            help='Run unit tests before finding solutions')
     args = parser.parse_args()
 
     constraints_file = args.constraints if args.constraints else DEFAULT_CONSTRAINTS_FILE    
     do_run_tests = args.tests
-    words_file = args.words if args.words else DEFAULT_WORDS_FILE
+    words_files = args.words if args.words else [DEFAULT_WORDS_FILE]
 
     if do_run_tests:
         unittest.TextTestRunner().run(unittest.TestLoader().loadTestsFromTestCase(TestXwordFunctions))
 
-    main(words_file, constraints_file)
+    if args.grid:
+        main_grid(words_files, args.grid, args.cache_dir, args.limit, args.exists, args.stats)
+    elif args.batch is not None:
+        main_batch(words_files, args.batch, args.cache_dir, args.jobs, args.count, args.limit, args.exists, args.stats)
+    else:
+        main(words_files, constraints_file, args.cache_dir, args.jobs, args.count, args.limit, args.exists, args.stats)
@@ -1,29 +1,140 @@
 #!/usr/bin/env python
 
 from abc import ABC
+import ast
+from fractions import Fraction
 import operator
+import unittest
+import weakref
+
+import numpy as np
+
+
+# Expression nodes are hash-consed: constructing a node equal to a live one returns the live one,
+# so equal subtrees are one object, and identity stands for structural equality.
+# Keys are (class, key of each field), where an Expr field is keyed by its id. A node keeps its
+# children alive, so an id in a live key cannot be reused by another object.
+# Floats are keyed on their exact bits, since == would merge 0.0 with -0.0, and never match NaN.
+_interned_nodes = weakref.WeakValueDictionary()
+
+
+def _field_key(value):
+    if isinstance(value, Expr):
+        return id(value)
+    if isinstance(value, float):
+        return (type(value), value.hex())
+    if isinstance(value, complex):
+        return (type(value), value.real.hex(), value.imag.hex())
+    if isinstance(value, np.generic):
+        return (type(value), value.tobytes())
+    return (type(value), value)
+
+
+def _make_node(cls, fields, values, intern=True):
+    key, node = None, None
+    if intern:
+        try:
+            key = (cls,) + tuple(map(_field_key, values))
+            node = _interned_nodes.get(key)
+        except TypeError:  # An unhashable value, which is not interned
+            key = None
+    if node is None:
+        node = object.__new__(cls)
+        for field, value in zip(fields, values):
+            object.__setattr__(node, field, value)
+        if key is not None:
+            _interned_nodes[key] = node
+    return node
+
+
+_BINOP_CLASSES = set()
+MAX_RECURSION_DEPTH = 200
+
+
+def _fold(expr, leaf, combine):
+    """Fold expr from the leaves up. leaf(node) gives the result of a leaf (which may be an operand
+    that is not an Expr), and combine(node, x_result, y_result) that of a binary node.
+    Each distinct node is folded once. A tree no deeper than MAX_RECURSION_DEPTH is folded
+    recursively, which is fastest for small trees. Reaching that depth abandons the recursion,
+    and the whole tree is folded with an explicit stack, reusing the results found so far.
+    """
+    results = {}  # Only binary nodes, as a leaf is cheaper to fold again than to look up
+
+    def visit(node, depth, binop_classes=_BINOP_CLASSES):
+        if type(node) not in binop_classes:
+            return leaf(node)
+        key = id(node)
+        if key in results:
+            return results[key]
+        if depth >= MAX_RECURSION_DEPTH:
+            raise _TooDeep()
+        result = combine(node, visit(node.x, depth + 1), visit(node.y, depth + 1))
+        results[key] = result
+        return result
+    try:
+        return visit(expr, 0)
+    except _TooDeep:
+        return _fold_iteratively(expr, leaf, combine, results)
+
+
+class _TooDeep(Exception):
+    pass
+
+
+def _fold_iteratively(expr, leaf, combine, done=None):
+    """As _fold, but children before parents with an explicit stack, dropping each result
+    once its last parent has used it. done maps the ids of nodes already folded, with all of
+    their descendants, to their results, which are reused.
+    """
+    done = {} if done is None else done
+    nodes = list(_postorder(expr, done))
+    uses = _get_use_counts(nodes)
+    results = {}
+
+    def result_of(x):
+        uses[id(x)] -= 1
+        return results[id(x)] if uses[id(x)] else results.pop(id(x))
+    for node, is_leaf in nodes:
+        if id(node) in done:
+            results[id(node)] = done.pop(id(node))
+        elif is_leaf:
+            results[id(node)] = leaf(node)
+        else:
+            results[id(node)] = combine(node, result_of(node.x), result_of(node.y))
+    return results[id(expr)]
+
+
+def _evaluate_leaf(node):
+    return node.evaluation() if isinstance(node, Expr) else node
+
+
+def _apply_op(node, x, y):
+    return node.op(x, y)
+
+
+def _concat_tokens(node, x, y):
+    return x + node.op_token + y
 
 
 def binop(op, op_token):
     def modified(cls):
-        def __init__(self, x, y):
-            self.x = x
-            self.y = y
+        def __new__(cls, x, y):
+            return _make_node(cls, ('x', 'y'), (x, y))
 
         def __str__(self):
-            return self.x.__str__() + op_token + self.y.__str__()
+            return _fold(self, str, _concat_tokens)
 
         def fmap(self, f):
-            return cls(f(self.x), f(self.y))
+            x, y = f(self.x), f(self.y)
+            # Only nodes of Exprs are interned, not those holding the results of a fold.
+            return _make_node(cls, ('x', 'y'), (x, y), intern=isinstance(x, Expr) and isinstance(y, Expr))
 
         def evaluation(self):
-            return op(self.x.evaluation()
-                          if issubclass(type(self.x), Expr)
-                          else self.x
-                    , self.y.evaluation()
-                          if issubclass(type(self.y), Expr)
-                          else self.y)
-        setattr(cls, '__init__', __init__)
+            return _fold(self, _evaluate_leaf, _apply_op)
+        _BINOP_CLASSES.add(cls)
+        setattr(cls, 'op', op)
+        setattr(cls, 'op_token', op_token)
+        setattr(cls, '__new__', staticmethod(__new__))
         setattr(cls, '__str__', __str__)
         setattr(cls, 'fmap', fmap)
         setattr(cls, 'evaluation', evaluation)
@@ -33,19 +144,119 @@ def binop(op, op_token):
 
 
 class Expr(ABC):
+    __slots__ = ('__weakref__',)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
     # Compare with the fixed-point combinator.
+    # Each distinct node is folded once, so a subtree shared by several parents is computed once,
+    # and deep trees do not hit the recursion limit.
     def cata(self, f):
-        cata_f = lambda x: x.cata(f)
-        fmapped = self.fmap(cata_f)
-        return f(fmapped)
+        return _fold(self, lambda node: f(node) if isinstance(node, Expr) else node,
+                     lambda node, x, y: f(_make_node(type(node), ('x', 'y'), (x, y), intern=False)))
 
     def eval_with(self, f):
+        # Folding directly gives the same results, without building a node for each step.
+        if f is evaluate:
+            return self.evaluation()
+        if f is str:
+            return str(self)
         return self.cata(f)
 
+    def compile(self):
+        """Return a function that gives the same value as evaluate(self), taking the value of
+        each variable as a keyword argument, without walking the tree: the tree becomes Python
+        statements compiled to bytecode. A subtree used more than once is computed once into a local,
+        as is every MAX_INLINE_HEIGHT levels of a deep tree, which the compiler could not nest.
+        """
+        nodes = list(_postorder(self))
+        uses = _get_use_counts(nodes)
+        names = sorted({node.name for node, _ in nodes if isinstance(node, ExprVar)})
+        prefix = '_c'
+        while any(name.startswith(prefix) for name in names):
+            prefix = '_' + prefix
+        consts = {}
+        body = []
+        exprs = {}  # id(node) -> (AST for its value, height of the AST)
+        for node, is_leaf in nodes:
+            if isinstance(node, ExprVar):
+                exprs[id(node)] = (ast.Name(id=node.name, ctx=ast.Load()), 0)
+            elif is_leaf:
+                const_name = f'{prefix}{len(consts)}'
+                consts[const_name] = _leaf_value(node)
+                exprs[id(node)] = (ast.Name(id=const_name, ctx=ast.Load()), 0)
+            else:
+                x, height_x = exprs[id(node.x)]
+                y, height_y = exprs[id(node.y)]
+                value = ast.BinOp(left=x, op=_AST_OPS[type(node).op](), right=y)
+                height = 1 + max(height_x, height_y)
+                if uses[id(node)] > 1 or height >= MAX_INLINE_HEIGHT:
+                    local_name = f'{prefix}t{len(body)}'
+                    body.append(ast.Assign(targets=[ast.Name(id=local_name, ctx=ast.Store())], value=value))
+                    value, height = ast.Name(id=local_name, ctx=ast.Load()), 0
+                exprs[id(node)] = (value, height)
+        body.append(ast.Return(value=exprs[id(self)][0]))
+
+        module = ast.parse('def compiled_expr(): pass')
+        func = module.body[0]
+        func.args.kwonlyargs = [ast.arg(arg=name) for name in names]
+        func.args.kw_defaults = [None] * len(names)
+        func.args.kwarg = ast.arg(arg=f'{prefix}bindings')  # Ignores unused bindings, as eval_batch does
+        func.body = body
+        namespace = dict(consts)
+        exec(compile(ast.fix_missing_locations(module), '<expr>', 'exec'), namespace)
+        return namespace['compiled_expr']
+
+    def eval_batch(self, bindings):
+        """Evaluate over whole columns at once. bindings maps each variable name to a NumPy array
+        (or anything np.asarray accepts), and the operators become the matching ufuncs, with NumPy's
+        broadcasting and dtype rules. Each intermediate result is written over an earlier one
+        where the shape and dtype allow, and that one is not used again, so there are few
+        temporaries however large the tree.
+        """
+        nodes = list(_postorder(self))
+        uses = _get_use_counts(nodes)
+        values = {}  # id(node) -> (value, is_temporary)
+        for node, is_leaf in nodes:
+            if isinstance(node, ExprVar):
+                values[id(node)] = (np.asarray(node.get_binding(bindings)), False)
+                continue
+            if is_leaf:
+                values[id(node)] = (_leaf_value(node), False)
+                continue
+            x, is_temp_x = values[id(node.x)]
+            y, is_temp_y = values[id(node.y)]
+            reusable = []
+            for child, is_temp in [(node.x, is_temp_x), (node.y, is_temp_y)]:
+                uses[id(child)] -= 1
+                if not uses[id(child)]:
+                    value, _ = values.pop(id(child))
+                    if is_temp:
+                        reusable.append(value)
+            ufunc = _UFUNCS[type(node).op]
+            out = None
+            if reusable:
+                try:
+                    dtype = ufunc.resolve_dtypes((_dtype_of(x), _dtype_of(y), None))[-1]
+                except TypeError:  # Operands such as Fractions, which have no NumPy dtype, reuse nothing
+                    reusable = []
+                shape = np.broadcast_shapes(np.shape(x), np.shape(y))
+                out = next((buffer for buffer in reusable if buffer.dtype == dtype and buffer.shape == shape), None)
+            result = ufunc(x, y, out=out)
+            # A ufunc gives a new array or out, never a binding, but gives a scalar for 0-d operands,
+            # which cannot be an out.
+            values[id(node)] = (result, isinstance(result, np.ndarray) and result.ndim > 0)
+        return values[id(self)][0]
+
 
 class ExprConst(Expr):
-    def __init__(self, x):
-        self.x = x
+    __slots__ = ('x',)
+    def __new__(cls, x):
+        return _make_node(cls, ('x',), (x,))
     def __str__(self):
         return self.x.__str__()
     def fmap(self, f):
@@ -54,24 +265,42 @@ class ExprConst(Expr):
         return self.x
 
 
+class ExprVar(Expr):
+    __slots__ = ('name',)
+    def __new__(cls, name):
+        if not (isinstance(name, str) and name.isidentifier()):
+            raise ValueError(f'ExprVar: Name must be an identifier: {name!r}')
+        return _make_node(cls, ('name',), (name,))
+    def __str__(self):
+        return self.name
+    def fmap(self, f):
+        return self
+    def get_binding(self, bindings):
+        if self.name not in bindings:
+            raise ValueError(f'ExprVar: Unbound variable: {self.name}')
+        return bindings[self.name]
+    def evaluation(self):
+        raise ValueError(f'ExprVar: Unbound variable: {self.name}')
+
+
 @binop(operator.add, '+')
 class ExprAdd(Expr):
-    pass
+    __slots__ = ('x', 'y')
 
 
 @binop(operator.truediv, '/')
 class ExprDiv(Expr):
-    pass
+    __slots__ = ('x', 'y')
 
 
 @binop(operator.mul, '*')
 class ExprMul(Expr):
-    pass
+    __slots__ = ('x', 'y')
 
 
 @binop(operator.sub, '-')
 class ExprSub(Expr):
-    pass
+    __slots__ = ('x', 'y')
 
 
 setattr(Expr, '__add__',     lambda self, other: ExprAdd(self, other))
@@ -84,6 +313,169 @@ def evaluate(expr):
     return expr.evaluation()
 
 
+MAX_INLINE_HEIGHT = 64
+
+_AST_OPS = { operator.add:     ast.Add
+           , operator.truediv: ast.Div
+           , operator.mul:     ast.Mult
+           , operator.sub:     ast.Sub
+           }
+
+_UFUNCS = { operator.add:     np.add
+          , operator.truediv: np.true_divide
+          , operator.mul:     np.multiply
+          , operator.sub:     np.subtract
+          }
+
+
+def _postorder(expr, stop_at=()):
+    """Yield (node, is_leaf) for each distinct node of expr once, children before parents, without recursion.
+    Leaves include any operands that are not Exprs, and nodes whose ids are in stop_at.
+    """
+    seen = set()
+    stack = [(expr, False)]
+    while stack:
+        node, visited = stack.pop()
+        if id(node) in seen:
+            continue
+        is_leaf = not hasattr(type(node), 'op') or id(node) in stop_at
+        if is_leaf or visited:
+            seen.add(id(node))
+            yield node, is_leaf
+        else:
+            stack += [(node, True), (node.y, False), (node.x, False)]
+
+
+def _get_use_counts(nodes):
+    """Return a dict from the id of each node to the number of its parents among nodes."""
+    uses = {id(node): 0 for node, _ in nodes}
+    for node, is_leaf in nodes:
+        if not is_leaf:
+            uses[id(node.x)] += 1
+            uses[id(node.y)] += 1
+    return uses
+
+
+def _leaf_value(node):
+    return node.evaluation() if isinstance(node, ExprConst) else node
+
+
+def _dtype_of(value):
+    return value.dtype if hasattr(value, 'dtype') else type(value)
+
+
+class TestInterning(unittest.TestCase):
+    def test_equal_nodes_are_one_object(self):
+        self.assertIs(ExprConst(1) + ExprVar('y'), ExprConst(1) + ExprVar('y'))
+
+    def test_signed_zero(self):
+        self.assertIsNot(ExprConst(0.0), ExprConst(-0.0))
+        self.assertEqual(str(ExprConst(-0.0)), '-0.0')
+        with np.errstate(divide='ignore'):
+            result = (ExprVar('y') / ExprConst(-0.0)).eval_batch({'y': np.ones(2)})
+        self.assertEqual(result.tolist(), [-np.inf, -np.inf])
+
+    def test_nan(self):
+        self.assertIs(ExprConst(float('nan')), ExprConst(float('nan')))
+
+
+class TestFold(unittest.TestCase):
+    def test_shared_subtree(self):
+        x = ExprConst(1) + ExprConst(0)
+        for _ in range(100):  # 2**100 paths from the root to the leaves, but 102 distinct nodes
+            x = x * x
+        self.assertEqual(str(ExprConst(2) * ExprConst(3) - ExprConst(4)), '2*3-4')
+        self.assertEqual(evaluate(ExprConst(2) + x / x), 3.0)
+
+    def test_deep_chain(self):
+        x = ExprConst(0)
+        for _ in range(5000):
+            x = x + ExprConst(1)
+        self.assertEqual(evaluate(x), 5000)
+        self.assertEqual(x.eval_with(evaluate), 5000)
+        self.assertEqual(str(x), '0' + '+1' * 5000)
+        self.assertEqual(x.cata(lambda node: 1 if isinstance(node, ExprConst) else node.x + node.y), 5001)
+
+    def test_deep_shared_subtree_is_folded_once(self):
+        shared = ExprConst(0)
+        for k in range(1000):
+            shared = shared + ExprConst(k)
+        x = shared
+        for k in range(500):
+            x = x + (shared * ExprConst(k))
+        calls = []
+
+        def count_calls(node):
+            calls.append(node)
+            return 0
+        x.cata(count_calls)
+        self.assertEqual(len(calls), len(list(_postorder(x))))
+        self.assertEqual(evaluate(x), sum(range(1000)) * (1 + sum(range(500))))
+
+    def test_cata_does_not_intern_results(self):
+        x = ExprConst(1) + ExprConst(2)
+        self.assertEqual(x.cata(lambda node: [node.x] if isinstance(node, ExprConst) else node.x + node.y), [1, 2])
+
+
+class TestCompile(unittest.TestCase):
+    def test_matches_evaluate(self):
+        x = ExprConst(1) + ExprConst(2) * ExprConst(3) / ExprConst(4) - ExprConst(0.5)
+        self.assertEqual(x.compile()(), evaluate(x))
+
+    def test_shared_subtrees(self):
+        x = ExprConst(1.5) - ExprConst(0.25)
+        for _ in range(100):
+            x = x * x / (x + ExprConst(1))
+        self.assertEqual(x.compile()(), evaluate(x))
+
+    def test_deep_chain(self):
+        x = ExprConst(0)
+        for k in range(10 * MAX_INLINE_HEIGHT):
+            x = (x + ExprConst(k)) if k % 2 else (x - ExprConst(0.5))
+        self.assertEqual(x.compile()(), evaluate(x))
+
+    def test_variables(self):
+        y = ExprVar('y')
+        x = (y + ExprConst(1)) * (ExprVar('z') - y)
+        compiled = x.compile()
+        self.assertEqual(compiled(y=2, z=5), 9)
+        self.assertEqual(compiled(y=2, z=5, unused=0), 9)
+        with self.assertRaises(TypeError):
+            compiled(y=2)
+
+    def test_zero_division(self):
+        x = ExprConst(1) + ExprConst(1) / (ExprConst(2) - ExprConst(2))
+        with self.assertRaises(ZeroDivisionError):
+            evaluate(x)
+        with self.assertRaises(ZeroDivisionError):
+            x.compile()()
+
+
+class TestEvalBatch(unittest.TestCase):
+    def test_arrays(self):
+        y = ExprVar('y')
+        result = ((y + ExprConst(1)) * (y - ExprConst(1)) / ExprConst(2)).eval_batch({'y': np.arange(4)})
+        self.assertEqual(result.tolist(), [-0.5, 0.0, 1.5, 4.0])
+
+    def test_bindings_are_not_overwritten(self):
+        y_vals = np.arange(4.0)
+        (ExprVar('y') + ExprConst(1) + ExprConst(2)).eval_batch({'y': y_vals})
+        self.assertEqual(y_vals.tolist(), [0.0, 1.0, 2.0, 3.0])
+
+    def test_scalar_bindings(self):
+        x = ExprVar('y') + ExprConst(1) + ExprConst(2)
+        self.assertEqual(x.eval_batch({'y': 5}), 8)
+        self.assertEqual(x.eval_batch({'y': np.float64(5)}), 8.0)
+
+    def test_operands_without_dtypes(self):
+        x = ExprVar('v') + ExprConst(1) + ExprConst(Fraction(1, 2))
+        self.assertEqual(x.eval_batch({'v': np.arange(3)}).tolist(), [Fraction(3, 2), Fraction(5, 2), Fraction(7, 2)])
+
+    def test_0d_bindings(self):
+        x = ExprVar('y') * ExprConst(2) + ExprConst(1) - ExprVar('y')
+        self.assertEqual(x.eval_batch({'y': np.array(5.0)}), 6.0)
+
+
 def expr_eval_demo():
     one = ExprConst(1)
     two = ExprConst(2)
@@ -92,8 +484,14 @@ def expr_eval_demo():
     x = one + two * three / four
     x_str = x.eval_with(str)
     x_val = x.eval_with(evaluate)
+    x_compiled = x.compile()
     print(f'Expression as string: {x_str}')
     print(f'Expression evaluated: {x_val}')
+    print(f'Expression compiled:  {x_compiled()}')
+    y = ExprVar('y')
+    y_expr = one + y * three / four
+    y_vals = np.arange(5)
+    print(f'Expression {y_expr.eval_with(str)} over y = {y_vals}: {y_expr.eval_batch({"y": y_vals})}')
 
 
 if __name__ == '__main__':
@@ -2,6 +2,12 @@
 
 # See the Java version of an interpretation of the data and functions
 
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+
 AMY = 'Amy'
 BOB = 'Bob'
 CAT = 'Cat'
@@ -22,13 +28,95 @@ team_members = {
     , OPS: [CAT, DAN]
     }
 
+
+# Lowest set bit of each byte value, or 8 for 0
+LOWEST_BIT = np.array([(b & -b).bit_length() - 1 if b else 8 for b in range(256)], dtype=np.int64)
+
+
+@dataclass
+class SlotMasks:
+    """Named rows of availability over slot_count time slots, such as the 15-minute slots of a year,
+    packed 8 slots to a byte: slot k is bit k % 8 of byte k // 8. Unused bits of the last byte are 0.
+    Operations on many rows are single NumPy operations over the packed bytes.
+    """
+    names: List[str]
+    bits: NDArray  # uint8, of shape (len(names), bytes per row)
+    slot_count: int
+    ids: Dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.ids = {name: k for k, name in enumerate(self.names)}
+
+    @staticmethod
+    def from_array(names: List[str], avail: NDArray) -> 'SlotMasks':
+        """avail - Array of shape (len(names), slot_count), true where available"""
+        avail = np.asarray(avail, dtype=bool)
+        if len(names) or avail.ndim != 2:
+            # With no rows, the slot count cannot be inferred, so there are none.
+            avail = avail.reshape((len(names), -1) if len(names) else (0, 0))
+        return SlotMasks(names, np.packbits(avail, axis=1, bitorder='little'), avail.shape[1])
+
+    @staticmethod
+    def from_lists(availabilities: Dict[str, Sequence[int]]) -> 'SlotMasks':
+        """availabilities - Dict from name to a list of 1 (available) or 0 for each slot"""
+        lengths = {len(avail) for avail in availabilities.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'SlotMasks: Availability lists differ in length: {sorted(lengths)}')
+        return SlotMasks.from_array(list(availabilities), np.array(list(availabilities.values())))
+
+    def to_array(self) -> NDArray:
+        return np.unpackbits(self.bits, axis=1, count=self.slot_count, bitorder='little').astype(bool)
+
+    def to_lists(self) -> Dict[str, List[int]]:
+        return {name: row for name, row in zip(self.names, self.to_array().astype(int).tolist())}
+
+    def _rows(self, names: Sequence[str]) -> NDArray:
+        try:
+            return np.array([self.ids[name] for name in names], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f'SlotMasks: Unknown name: {e.args[0]}')
+
+    def _reduce_groups(self, ufunc, groups: Dict[str, List[str]]) -> 'SlotMasks':
+        sizes = np.array([len(members) for members in groups.values()], dtype=np.int64)
+        rows = self._rows([member for members in groups.values() for member in members])
+        bits = np.zeros((len(groups), self.bits.shape[1]), dtype=np.uint8)
+        is_nonempty = sizes > 0
+        if len(rows):
+            # reduceat combines the rows from each group's offset up to the next offset.
+            offsets = np.cumsum(sizes) - sizes
+            bits[is_nonempty] = ufunc.reduceat(self.bits[rows], offsets[is_nonempty], axis=0)
+        return SlotMasks(list(groups), bits, self.slot_count)
+
+    def unions(self, groups: Dict[str, List[str]]) -> 'SlotMasks':
+        """Return a row for each group, of the slots where any of its members is available."""
+        return self._reduce_groups(np.bitwise_or, groups)
+
+    def intersections(self, groups: Dict[str, List[str]]) -> 'SlotMasks':
+        """Return a row for each group, of the slots where all of its members are available.
+        An empty group is available in no slot.
+        """
+        return self._reduce_groups(np.bitwise_and, groups)
+
+    def first_common_slots(self, xs: Sequence[str], ys: Sequence[str]) -> NDArray:
+        """Return, for each k, the first slot where both xs[k] and ys[k] are available, or -1 if none."""
+        common = self.bits[self._rows(xs)] & self.bits[self._rows(ys)]
+        if not common.shape[1]:
+            return np.full(len(common), -1, dtype=np.int64)
+        first_bytes = np.argmax(common != 0, axis=1)
+        first_bits = LOWEST_BIT[common[np.arange(len(common)), first_bytes]]
+        return np.where(first_bits < 8, first_bytes * 8 + first_bits, -1)
+
+    def first_common_slot(self, x: str, y: str) -> Optional[int]:
+        slot = int(self.first_common_slots([x], [y])[0])
+        return slot if slot >= 0 else None
+
+
 def get_team_avail(member_availabilities, team_members):
-    mem2avail = lambda b: member_availabilities[b]
-    unify_n = lambda xss, n: any([xs[n] == 1 for xs in xss])
-    unify = lambda xss: [1 if unify_n(xss, n) else 0 for n in range(7)]
-    result = {k: unify(list(map(mem2avail, v))) for k, v in team_members.items()}
+    result = SlotMasks.from_lists(member_availabilities).unions(team_members).to_lists()
     return result
 
 if __name__ == '__main__':
     for k, v in sorted(get_team_avail(member_availabilities, team_members).items()):
         print(f'{k}: {v}')
+    teams = SlotMasks.from_lists(member_availabilities).unions(team_members)
+    print(f'First slot where {DEV} and {OPS} both have coverage: {teams.first_common_slot(DEV, OPS)}')
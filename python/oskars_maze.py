@@ -8,17 +8,385 @@
 # (Some mazes have pre-selected start and finish points, but this maze does not.)
 #
 # Coordinates used range from 0 to 10 for each of the x, y, and z axes.
+# Other mazes of any odd size N, with coordinates from 0 to N-1, can be read from panel files
+# or generated at random.
+#
+# Usage: oskars_maze.py [-f PANELS_FILE] {stats,paths,dot} ...
+# networkx is imported only by the commands that need its graph, and pygraphviz only by dot.
 
-import networkx as nx  # type: ignore
-from networkx.classes import Graph  # type: ignore
-from networkx.drawing.nx_agraph import write_dot
-from typing import List, TextIO, Tuple, Union
+import argparse
+from dataclasses import dataclass
+import heapq
+import os
+import sys
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, TextIO, Tuple, Union
+import unittest
 
 import numpy as np
-from numpy.ma import make_mask
 from numpy.typing import NDArray
 
+if TYPE_CHECKING:
+    from networkx.classes import Graph  # type: ignore
+
 Pos = Tuple[int, int, int]
+Panels = Tuple[str, str, str]  # The xy, yz and zx panels, as strings in the form of OskarsMaze.xy
+
+
+@dataclass
+class CellGraph:
+    """The open cells of a maze cube, and which of them share a face, in compressed sparse row form.
+    Cells are numbered in C order of their positions, and the neighbors of cell k are
+    indices[indptr[k]:indptr[k + 1]], in increasing order.
+    """
+    positions: NDArray  # (n, 3) array of the position of each cell
+    ids: NDArray        # Array shaped like the cube, of the number of each open cell, or -1 where obstructed
+    indptr: NDArray
+    indices: NDArray
+
+    @staticmethod
+    def from_cube(xyz: NDArray) -> 'CellGraph':
+        """Build from a boolean cube in which True is an obstacle.
+        Shifting the array of cell numbers one step in each of the six directions gives every cell's
+        neighbor in that direction at once. The directions are taken in the order that makes the
+        neighbors' numbers increase, so the rows come out sorted.
+        """
+        is_open = ~xyz
+        positions = np.argwhere(is_open)
+        ids = np.full(xyz.shape, -1, dtype=np.int64)
+        ids[is_open] = np.arange(len(positions))
+        padded = np.pad(ids, 1, constant_values=-1)
+        nbr_vecs = [(-1,0,0), (0,-1,0), (0,0,-1), (0,0,1), (0,1,0), (1,0,0)]
+        nbr_ids = np.empty((len(positions), len(nbr_vecs)), dtype=np.int64)
+        for column, nbr_vec in enumerate(nbr_vecs):
+            shifted = padded[tuple(slice(1 + d, 1 + d + n) for d, n in zip(nbr_vec, xyz.shape))]
+            nbr_ids[:, column] = shifted[is_open]
+        is_nbr = nbr_ids >= 0
+        indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(np.count_nonzero(is_nbr, axis=1), out=indptr[1:])
+        return CellGraph(positions, ids, indptr, nbr_ids[is_nbr])
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def cell_id(self, pos: Pos) -> int:
+        """Return the number of the open cell at pos, or -1 if pos is obstructed or outside the cube."""
+        if not all(0 <= c < n for c, n in zip(pos, self.ids.shape)):
+            return -1
+        return int(self.ids[tuple(pos)])
+
+    def position(self, k: int) -> Pos:
+        x, y, z = self.positions[k].tolist()
+        return (x, y, z)
+
+    def neighbors(self, k: int) -> NDArray:
+        return self.indices[self.indptr[k]:self.indptr[k + 1]]
+
+    def degrees(self) -> NDArray:
+        return np.diff(self.indptr)
+
+    def edges(self) -> Tuple[NDArray, NDArray]:
+        """Return arrays of the two cells of each edge, the lower numbered first."""
+        sources = np.repeat(np.arange(len(self)), self.degrees())
+        is_lower = sources < self.indices
+        return sources[is_lower], self.indices[is_lower]
+
+    def component_labels(self) -> NDArray:
+        """Return a label for each cell, numbering the connected components 0, 1, 2, ..."""
+        # Each pass hooks the root of each edge's higher root onto its lower root, then points every
+        # cell at its root by pointer jumping. roots[k] <= k throughout, so the jumping ends, and
+        # once no root changes, the two cells of every edge have the same root.
+        roots = np.arange(len(self))
+        sources, targets = self.edges()
+        while True:
+            root_sources, root_targets = roots[sources], roots[targets]
+            lower = np.minimum(root_sources, root_targets)
+            higher = np.maximum(root_sources, root_targets)
+            is_split = lower != higher
+            if not is_split.any():
+                break
+            np.minimum.at(roots, higher[is_split], lower[is_split])
+            while True:
+                jumped = roots[roots]
+                if np.array_equal(jumped, roots):
+                    break
+                roots = jumped
+        return np.unique(roots, return_inverse=True)[1].astype(np.int64)
+
+
+class ContractedGraph:
+    """The cell graph with each corridor contracted to a single edge, weighted by its length in steps.
+    A corridor is a chain of cells with two neighbors each, straight or bent. Its ends are nodes:
+    cells with one neighbor or more than two, or else one cell of a loop with no such cells.
+    Cells with no neighbors are left out.
+
+    Edge e joins nodes edge_ends[e] through the cells edge_cells[edge_ptr[e]:edge_ptr[e + 1]],
+    listed from edge_ends[e, 0], and has length one more than their number.
+    Each corridor cell records its edge, and its distance from the edge's first end.
+    The contraction visits each cell once, and paths are found by Dijkstra's algorithm on the
+    smaller graph, then expanded back to cells.
+    """
+    def __init__(self, cells: CellGraph) -> None:
+        self.cells = cells
+        indptr = cells.indptr.tolist()
+        indices = cells.indices.tolist()
+        degrees = cells.degrees().tolist()
+        node_ids = [-1] * len(cells)
+        cell_edges = [-1] * len(cells)
+        cell_offsets = [0] * len(cells)
+        node_cells: List[int] = []
+        edge_ends: List[Tuple[int, int]] = []
+        edge_ptr = [0]
+        edge_cells: List[int] = []
+
+        def add_node(cell):
+            node_ids[cell] = len(node_cells)
+            node_cells.append(cell)
+
+        def walk_from(node_cell):
+            for nbr in indices[indptr[node_cell]:indptr[node_cell + 1]]:
+                if node_ids[nbr] >= 0:
+                    if node_cell < nbr:  # Adjacent nodes. Add the edge from the lower one only.
+                        edge_ends.append((node_ids[node_cell], node_ids[nbr]))
+                        edge_ptr.append(len(edge_cells))
+                    continue
+                if cell_edges[nbr] >= 0:  # The corridor was walked from its other end.
+                    continue
+                edge = len(edge_ends)
+                prev, cell = node_cell, nbr
+                offset = 1
+                while node_ids[cell] < 0:
+                    cell_edges[cell] = edge
+                    cell_offsets[cell] = offset
+                    edge_cells.append(cell)
+                    first_nbr = indices[indptr[cell]]
+                    prev, cell = cell, first_nbr if first_nbr != prev else indices[indptr[cell] + 1]
+                    offset += 1
+                edge_ends.append((node_ids[node_cell], node_ids[cell]))
+                edge_ptr.append(len(edge_cells))
+
+        for cell, degree in enumerate(degrees):
+            if degree and degree != 2:
+                add_node(cell)
+        for node_cell in list(node_cells):
+            walk_from(node_cell)
+        for cell, degree in enumerate(degrees):
+            if degree == 2 and cell_edges[cell] < 0 and node_ids[cell] < 0:  # A loop of corridor cells
+                add_node(cell)
+                walk_from(cell)
+
+        self.node_cells = np.array(node_cells, dtype=np.int64)
+        self.node_ids = np.array(node_ids, dtype=np.int64)
+        self.edge_ends = np.array(edge_ends, dtype=np.int64).reshape((len(edge_ends), 2))
+        self.edge_ptr = np.array(edge_ptr, dtype=np.int64)
+        self.edge_cells = np.array(edge_cells, dtype=np.int64)
+        self.edge_lengths = np.diff(self.edge_ptr) + 1
+        self.cell_edges = np.array(cell_edges, dtype=np.int64)
+        self.cell_offsets = np.array(cell_offsets, dtype=np.int64)
+
+        # For each node, (neighbor, length, edge) for the shortest edge to each neighbor.
+        # Other edges between the same nodes are never on a shortest path.
+        self.adjacency: List[Dict[int, Tuple[int, int]]] = [{} for _ in node_cells]
+        for edge, ((a, b), length) in enumerate(zip(edge_ends, self.edge_lengths.tolist())):
+            if a != b and (b not in self.adjacency[a] or length < self.adjacency[a][b][0]):
+                self.adjacency[a][b] = (length, edge)
+                self.adjacency[b][a] = (length, edge)
+
+    def __len__(self) -> int:
+        return len(self.node_cells)
+
+    def weighted_nbrs(self) -> List[List[Tuple[int, int]]]:
+        """Return, for each node, (neighbor, length) for the shortest edge to each neighbor."""
+        return [[(nbr, length) for nbr, (length, _) in nbrs.items()] for nbrs in self.adjacency]
+
+    def _attachments(self, cell: int) -> List[Tuple[int, int]]:
+        """Return (node, distance) for the nodes nearest cell in each direction."""
+        if self.node_ids[cell] >= 0:
+            return [(int(self.node_ids[cell]), 0)]
+        edge = self.cell_edges[cell]
+        if edge < 0:
+            return []
+        offset = int(self.cell_offsets[cell])
+        a, b = self.edge_ends[edge].tolist()
+        return [(a, offset), (b, int(self.edge_lengths[edge]) - offset)]
+
+    def _cells_to_node(self, cell: int, node: int) -> List[int]:
+        """Return the cells from cell along its edge to node, one of the edge's ends, excluding node."""
+        if self.node_ids[cell] >= 0:
+            return []
+        edge = self.cell_edges[cell]
+        edge_cells = self.edge_cells[self.edge_ptr[edge]:self.edge_ptr[edge + 1]].tolist()
+        k = int(self.cell_offsets[cell]) - 1
+        to_first_end = self.edge_ends[edge, 0] == node
+        if self.edge_ends[edge, 0] == self.edge_ends[edge, 1]:  # A loop. Take the shorter way round.
+            to_first_end = k < len(edge_cells) - k
+        return edge_cells[k::-1] if to_first_end else edge_cells[k:]
+
+    def _edge_cells_from(self, edge: int, node: int) -> List[int]:
+        """Return the corridor cells of edge, listed from its end node."""
+        edge_cells = self.edge_cells[self.edge_ptr[edge]:self.edge_ptr[edge + 1]].tolist()
+        return edge_cells if self.edge_ends[edge, 0] == node else edge_cells[::-1]
+
+    def _dijkstra(self, sources: List[Tuple[int, int]],
+                  targets: Dict[int, int]) -> Tuple[int, int, Dict[int, int]]:
+        """Search from the sources, (node, initial distance), until the best target is settled.
+        targets maps each target node to the distance to add on arriving there.
+        Return the best total distance, the target reaching it, and the predecessor of each node reached.
+        """
+        dists: Dict[int, int] = {}
+        preds: Dict[int, int] = {}
+        heap = [(dist, node, node) for node, dist in sources]
+        heapq.heapify(heap)
+        best = (-1, -1)
+        while heap:
+            dist, node, pred = heapq.heappop(heap)
+            if node in dists:
+                continue
+            if best[0] >= 0 and dist >= best[0]:
+                break
+            dists[node] = dist
+            preds[node] = pred
+            if node in targets and (best[0] < 0 or dist + targets[node] < best[0]):
+                best = (dist + targets[node], node)
+            for nbr, (length, _) in self.adjacency[node].items():
+                if nbr not in dists:
+                    heapq.heappush(heap, (dist + length, nbr, node))
+        return best[0], best[1], preds
+
+    def expand(self, nodes: List[int]) -> List[int]:
+        """Return the cells of a path through the given nodes, each adjacent to the next."""
+        path = [int(self.node_cells[nodes[0]])]
+        for a, b in zip(nodes, nodes[1:]):
+            path += self._edge_cells_from(self.adjacency[a][b][1], a)
+            path.append(int(self.node_cells[b]))
+        return path
+
+    def shortest_path(self, a: int, b: int,
+                      path_index: Optional['PathIndex'] = None) -> Optional[Tuple[int, List[int]]]:
+        """Return the length of a shortest path from cell a to cell b, and its cells, including both,
+        or None if there is none. Uses path_index for the distances between nodes if given,
+        and otherwise Dijkstra's algorithm.
+        """
+        if a == b:
+            return 0, [a]
+        sources = self._attachments(a)
+        targets: Dict[int, int] = {}
+        for node, dist in self._attachments(b):
+            targets[node] = min(dist, targets.get(node, dist))
+        best_length, best_nodes = -1, None
+        if path_index is None:
+            length, target, preds = self._dijkstra(sources, targets)
+            if length >= 0:
+                best_length, best_nodes = length, [target]
+                while preds[best_nodes[-1]] != best_nodes[-1]:
+                    best_nodes.append(preds[best_nodes[-1]])
+                best_nodes.reverse()
+        else:
+            for source, source_dist in sources:
+                for target, target_dist in targets.items():
+                    dist = path_index.distance_by_id(source, target)
+                    if dist is not None and (best_length < 0 or source_dist + dist + target_dist < best_length):
+                        best_length, best_nodes = source_dist + dist + target_dist, [source, target]
+            if best_nodes:
+                best_nodes = path_index.path_by_id(best_nodes[0], best_nodes[1])
+
+        edge = self.cell_edges[a]
+        if edge >= 0 and edge == self.cell_edges[b]:  # Both in one corridor, which may be the shortest way.
+            k_a, k_b = int(self.cell_offsets[a]) - 1, int(self.cell_offsets[b]) - 1
+            if best_length < 0 or abs(k_a - k_b) < best_length:
+                edge_cells = self.edge_cells[self.edge_ptr[edge]:self.edge_ptr[edge + 1]].tolist()
+                if k_a < k_b:
+                    return k_b - k_a, edge_cells[k_a:k_b + 1]
+                return k_a - k_b, edge_cells[k_b:k_a + 1][::-1]
+        if best_nodes is None:
+            return None
+        cells = self._cells_to_node(a, best_nodes[0]) + self.expand(best_nodes)
+        cells += self._cells_to_node(b, best_nodes[-1])[::-1]
+        return best_length, cells
+
+
+class PathIndex:
+    """Shortest paths between every pair of nodes of a weighted graph, found once by Dijkstra's algorithm
+    from every node. distance() takes O(1) time, and path() time proportional to the path's length.
+
+    distances[b, a] is the length of a shortest path between a and b, or -1 if there is none, and
+    next_hops[b, a] is the node after a on such a path to b. The arrays are saved to a directory
+    as .npy files, and load() memory-maps them, so a large index is read only where it is used.
+    """
+    FILE_NAMES = ['positions.npy', 'distances.npy', 'next_hops.npy']
+
+    def __init__(self, positions: NDArray, distances: NDArray, next_hops: NDArray) -> None:
+        self.positions = positions
+        self.distances = distances
+        self.next_hops = next_hops
+        self.ids: Dict[Pos, int] = {pos: k for k, pos in enumerate(map(tuple, positions.tolist()))}
+
+    @staticmethod
+    def build(positions: Sequence[Pos], nbrs: Sequence[Sequence[Tuple[int, int]]]) -> 'PathIndex':
+        """positions - The position of each node
+        nbrs - (neighbor, edge length) for the neighbors of each node
+        """
+        count = len(positions)
+        distances = np.full((count, count), -1, dtype=np.int32)
+        next_hops = np.full((count, count), -1, dtype=np.int32)
+        for target in range(count):
+            dists = [-1] * count
+            hops = [-1] * count
+            heap = [(0, target, target)]
+            while heap:
+                dist, node, hop = heapq.heappop(heap)
+                if dists[node] >= 0:
+                    continue
+                dists[node] = dist
+                hops[node] = hop
+                for nbr, length in nbrs[node]:
+                    if dists[nbr] < 0:
+                        heapq.heappush(heap, (dist + length, nbr, node))
+            distances[target] = dists
+            next_hops[target] = hops
+        return PathIndex(np.array(positions, dtype=np.int32).reshape((count, 3)), distances, next_hops)
+
+    def save(self, dir_path: str) -> None:
+        os.makedirs(dir_path, exist_ok=True)
+        for file_name, array in zip(PathIndex.FILE_NAMES, [self.positions, self.distances, self.next_hops]):
+            np.save(os.path.join(dir_path, file_name), array)
+
+    @staticmethod
+    def load(dir_path: str) -> 'PathIndex':
+        positions, distances, next_hops = [np.load(os.path.join(dir_path, file_name), mmap_mode='r')
+                                           for file_name in PathIndex.FILE_NAMES]
+        return PathIndex(positions, distances, next_hops)
+
+    def _id(self, pos: Pos) -> int:
+        if pos not in self.ids:
+            raise ValueError(f'PathIndex: Not a node: {pos}')
+        return self.ids[pos]
+
+    def distance(self, a: Pos, b: Pos) -> Optional[int]:
+        """Return the length of a shortest path from a to b, or None if there is none."""
+        return self.distance_by_id(self._id(a), self._id(b))
+
+    def path(self, a: Pos, b: Pos) -> Optional[List[Pos]]:
+        """Return the nodes of a shortest path from a to b, including both, or None if there is none."""
+        path = self.path_by_id(self._id(a), self._id(b))
+        return None if path is None else [self.position(k) for k in path]
+
+    def distance_by_id(self, a: int, b: int) -> Optional[int]:
+        dist = int(self.distances[b, a])
+        return dist if dist >= 0 else None
+
+    def path_by_id(self, a: int, b: int) -> Optional[List[int]]:
+        hops = self.next_hops[b]
+        if hops[a] < 0:
+            return None
+        path = [a]
+        while a != b:
+            a = int(hops[a])
+            path.append(a)
+        return path
+
+    def position(self, k: int) -> Pos:
+        x, y, z = self.positions[k].tolist()
+        return (x, y, z)
 
 
 # Note: The commercial product does not have labeled axes.
@@ -68,104 +436,346 @@ class OskarsMaze:
 
     @staticmethod
     def _get_cube(xy: NDArray, yz: NDArray, zx: NDArray) -> NDArray:
-        xyz = np.zeros((11, 11, 11), dtype=bool)
-        for x in range(0, 11):
-            for y in range(0, 11):
-                for z in range(0, 11):
-                    if xy[(x, y)] or yz[(y, z)] or zx[(z, x)]:
-                        xyz[(x, y, z)] = True
-        return xyz
+        """Return the cube in which (x, y, z) is obstructed if xy[x, y], yz[y, z] or zx[z, x] is."""
+        return xy[:, :, np.newaxis] | yz[np.newaxis, :, :] | zx.T[:, np.newaxis, :]
 
     @staticmethod
-    def _get_graph(xyz: NDArray, do_remove_nonbranching_nodes=True) -> Graph:
-        def tup_sum(a, b):
-            return (a[0]+b[0], a[1]+b[1], a[2]+b[2])
-
-        node_pos = list(zip(*np.where(~xyz)))  # Unobstructed positions
-        nbr_vecs = [(-1,0,0), (1,0,0)] + [(0,-1,0), (0,1,0)] + [(0,0,-1), (0,0,1)]
-        graph: Graph = nx.Graph()  # type: ignore
-        for from_pos in node_pos:
-            for nbr_vec in nbr_vecs:
-                to_pos = tup_sum(from_pos, nbr_vec)
-                if to_pos in node_pos:  # Both endpoints are graph nodes. Found an edge.
-                    graph.add_edge(from_pos, to_pos)
-
-        if do_remove_nonbranching_nodes:
-            # If a node has only 2 neighbors, and all 3 nodes are collinear,
-            # then remove the center node and join its two neighbors.
-            # This process reduces the node count from 220 to 106.
-            for node in list(graph.nodes):
-                nbrs = list(graph.neighbors(node))
-                if len(nbrs) == 2:
-                    nbr_a = nbrs[0]
-                    nbr_b = nbrs[1]
-                    same_x = node[0] == nbr_a[0] == nbr_b[0]
-                    same_y = node[1] == nbr_a[1] == nbr_b[1]
-                    same_z = node[2] == nbr_a[2] == nbr_b[2]
-                    if (same_x and same_y) or (same_x and same_z) or (same_y and same_z):
-                        graph.remove_edge(node, nbr_a)
-                        graph.remove_edge(node, nbr_b)
-                        graph.remove_node(node)
-                        graph.add_edge(nbr_a, nbr_b)
+    def _get_graph(cells: CellGraph, contracted: Optional[ContractedGraph] = None) -> 'Graph':
+        """Return the networkx graph of the cells, or of the contracted graph if given,
+        with the length of each edge as its weight.
+        """
+        import networkx as nx  # type: ignore
+        graph: 'Graph' = nx.Graph()  # type: ignore
+        positions = cells.positions.tolist()
+        if contracted is None:
+            sources, targets = cells.edges()
+            graph.add_edges_from((tuple(positions[a]), tuple(positions[b]), {'weight': 1})
+                                 for a, b in zip(sources.tolist(), targets.tolist()))
+        else:
+            node_positions = [tuple(positions[cell]) for cell in contracted.node_cells.tolist()]
+            graph.add_nodes_from(node_positions)
+            graph.add_edges_from((node_positions[a], node_positions[b], {'weight': length})
+                                 for a, nbrs in enumerate(contracted.adjacency)
+                                 for b, (length, _) in nbrs.items() if a < b)
         return graph
 
     @staticmethod
-    def _get_panel(s: str):
+    def _get_panel(s: str) -> NDArray:
         """Convert a 2D string-based cross-sections of the maze to numpy array.
         In the numpy array form, True represents an obstacle; False, an empty space.
+        The panel must be square. Leading and trailing whitespace of each row, and blank rows, are ignored.
         """
-        tr_map = str.maketrans('* ', '10')
-        rows = map(lambda x: x.strip().translate(tr_map), s.split('\n')[1:])
-        ints = [int(c) for c in ''.join(rows)]
-        return make_mask(ints).reshape((11, 11))
+        rows = [row.strip() for row in s.split('\n') if row.strip()]
+        if any(len(row) != len(rows) for row in rows):
+            raise ValueError(f'OskarsMaze: Panel is not square: {len(rows)} rows, of lengths'
+                             f' {sorted({len(row) for row in rows})}')
+        chars = np.frombuffer(''.join(rows).encode(), dtype=np.uint8)
+        if not np.all((chars == ord('*')) | (chars == ord(' '))):
+            raise ValueError("OskarsMaze: Panel may contain only '*' and ' '")
+        return (chars == ord('*')).reshape((len(rows), len(rows)))
 
     @staticmethod
-    def get_corners() -> List[Pos]:
-        return [(x, y, z) for x in [1, 9] for y in [1, 9] for z in [1, 9]]
+    def get_corners(size=11) -> List[Pos]:
+        return [(x, y, z) for x in [1, size - 2] for y in [1, size - 2] for z in [1, size - 2]]
 
     # ========================================
 
-    def __init__(self, do_remove_nonbranching_nodes=True) -> None:
-        panel_xy = OskarsMaze._get_panel(OskarsMaze.xy)
-        panel_yz = OskarsMaze._get_panel(OskarsMaze.yz)
-        panel_zx = OskarsMaze._get_panel(OskarsMaze.zx)
+    def __init__(self, do_remove_nonbranching_nodes=True, panels: Optional[Panels] = None) -> None:
+        """do_remove_nonbranching_nodes - Whether the graph contracts corridors to weighted edges.
+        Path queries always use the contracted graph.
+        panels - The xy, yz and zx panels, all the same size [Default is those of Oskar's Maze]
+        Only the cell graph is built here. The contracted graph, and the networkx graph for DOT output,
+        are built on first use.
+        """
+        if panels is None:
+            panels = (OskarsMaze.xy, OskarsMaze.yz, OskarsMaze.zx)
+        panel_xy, panel_yz, panel_zx = map(OskarsMaze._get_panel, panels)
+        if not panel_xy.shape == panel_yz.shape == panel_zx.shape:
+            raise ValueError('OskarsMaze: Panels differ in size')
+        self.size = len(panel_xy)
         cube = OskarsMaze._get_cube(panel_xy, panel_yz, panel_zx)
-        self.graph = OskarsMaze._get_graph(cube, do_remove_nonbranching_nodes)
+        self.cells = CellGraph.from_cube(cube)
+        self.do_remove_nonbranching_nodes = do_remove_nonbranching_nodes
+        self._contracted: Optional[ContractedGraph] = None
+        self._graph: Optional['Graph'] = None
+        self.path_index: Optional[PathIndex] = None
+
+    @staticmethod
+    def from_file(path: str, **kwargs) -> 'OskarsMaze':
+        """Return the maze whose panels are in the file at path. See read_panels."""
+        return OskarsMaze(panels=read_panels(path), **kwargs)
+
+    @property
+    def contracted(self) -> ContractedGraph:
+        if self._contracted is None:
+            self._contracted = ContractedGraph(self.cells)
+        return self._contracted
+
+    @property
+    def graph(self) -> 'Graph':
+        if self._graph is None:
+            self._graph = OskarsMaze._get_graph(self.cells,
+                                                self.contracted if self.do_remove_nonbranching_nodes else None)
+        return self._graph
+
+    def number_of_cells(self) -> int:
+        return len(self.cells)
+
+    # The graph holds only cells with neighbors, so isolated cells are left out of these counts.
 
     def number_of_connected_components(self) -> int:
-        return nx.number_connected_components(self.graph)  # type: ignore
+        is_connected = self.cells.degrees() > 0
+        return len(np.unique(self.cells.component_labels()[is_connected]))
 
     def number_of_nodes(self) -> int:
-        return self.graph.number_of_nodes()
+        """Return the number of nodes of the graph, without building it."""
+        if self.do_remove_nonbranching_nodes:
+            return len(self.contracted)
+        return int(np.count_nonzero(self.cells.degrees() > 0))
+
+    def _get_node_positions(self) -> List[Pos]:
+        return [self.cells.position(cell) for cell in self.contracted.node_cells.tolist()]
+
+    def get_path_index(self) -> PathIndex:
+        """Return the index of shortest paths between the contracted graph's nodes, building it on first use.
+        Until it is built or loaded, each path query runs Dijkstra's algorithm instead.
+        """
+        if self.path_index is None:
+            self.path_index = PathIndex.build(self._get_node_positions(), self.contracted.weighted_nbrs())
+        return self.path_index
+
+    def save_path_index(self, dir_path: str) -> None:
+        self.get_path_index().save(dir_path)
+
+    def load_path_index(self, dir_path: str) -> None:
+        path_index = PathIndex.load(dir_path)
+        if not np.array_equal(path_index.positions, np.array(self._get_node_positions()).reshape((-1, 3))):
+            raise ValueError(f'OskarsMaze: Path index in {dir_path} is for a different maze')
+        self.path_index = path_index
+
+    def _shortest_path(self, from_pos: Pos, to_pos: Pos) -> Optional[Tuple[int, List[int]]]:
+        from_cell = self.cells.cell_id(from_pos)
+        to_cell = self.cells.cell_id(to_pos)
+        for pos, cell in [(from_pos, from_cell), (to_pos, to_cell)]:
+            if cell < 0:
+                raise ValueError(f'OskarsMaze: Not an open cell: {pos}')
+        return self.contracted.shortest_path(from_cell, to_cell, self.path_index)
+
+    def distance(self, from_pos: Pos, to_pos: Pos) -> Optional[int]:
+        """Return the number of steps of a shortest path between open cells, or None if there is none."""
+        result = self._shortest_path(from_pos, to_pos)
+        return None if result is None else result[0]
+
+    def path(self, from_pos: Pos, to_pos: Pos) -> Optional[List[Pos]]:
+        """Return the cells of a shortest path between open cells, including both, or None if there is none."""
+        result = self._shortest_path(from_pos, to_pos)
+        return None if result is None else [self.cells.position(cell) for cell in result[1]]
 
     def print_paths(self, nodes: List[Pos]) -> None:
         for i in range(len(nodes)):
             for j in range(i + 1, len(nodes)):
                 from_pos = nodes[i]
                 to_pos = nodes[j]
-                has_path = nx.has_path(self.graph, from_pos, to_pos)  # type: ignore
-                if has_path:
-                    path = nx.shortest_path(self.graph, from_pos, to_pos)  # type: ignore
-                    print(f'Path from {from_pos} to {to_pos}: Shortest length = {len(path) - 1}')
+                distance = self.distance(from_pos, to_pos)
+                if distance is not None:
+                    print(f'Path from {from_pos} to {to_pos}: Shortest length = {distance}')
                 else:
                     print(f'Path from {from_pos} to {to_pos}: None')
 
     def write_dot(self, path_or_filehandle: Union[str, TextIO]) -> None:
-        write_dot(self.graph, f)
+        from networkx.drawing.nx_agraph import write_dot  # Needs pygraphviz
+        write_dot(self.graph, path_or_filehandle)
 
 
-if __name__ == '__main__':
-    def assert_nodes_are_in_maze(maze: OskarsMaze, nodes):
-        are_corners_in_maze = [(x, y, z) in maze.graph
-                               for (x, y, z) in OskarsMaze.get_corners()]
-        assert(all(are_corners_in_maze))
-
-    maze = OskarsMaze()
-    print(f"INFO: Oskar's Maze has {maze.number_of_nodes()} nodes.")
-    print(f"INFO: Oskar's Maze has {maze.number_of_connected_components()} connected components.")
-    nodes = OskarsMaze.get_corners()
-    assert_nodes_are_in_maze(maze, nodes)
-    maze.print_paths(nodes)
-    with open('oskars_maze.dot', 'w') as f:
+def read_panels(path: str) -> Panels:
+    """Read the xy, yz and zx panels of a maze from a file, in that order, separated by blank lines."""
+    with open(path) as f:
+        panels = [panel for panel in f.read().split('\n\n') if panel.strip()]
+    if len(panels) != 3:
+        raise ValueError(f'OskarsMaze: Expected 3 panels in {path}, but found {len(panels)}')
+    return (panels[0], panels[1], panels[2])
+
+
+def write_panels(path: str, panels: Panels) -> None:
+    with open(path, 'w') as f:
+        f.write('\n\n'.join(panel.strip('\n') for panel in panels) + '\n')
+
+
+def panel_to_str(panel: NDArray) -> str:
+    return '\n'.join(''.join('*' if is_wall else ' ' for is_wall in row) for row in panel)
+
+
+def _carve_panel_maze(panel: NDArray, rng: np.random.Generator) -> None:
+    """Carve a random spanning tree of the odd-coordinate cells of panel into it, by depth-first search.
+    The cells are at odd coordinates, and the walls between them at even ones.
+    """
+    size = len(panel)
+    is_visited = np.zeros(panel.shape, dtype=bool)
+    stack = [(1, 1)]
+    is_visited[1, 1] = True
+    panel[1, 1] = False
+    while stack:
+        r, c = stack[-1]
+        nbrs = [(r + dr, c + dc) for dr, dc in [(-2, 0), (2, 0), (0, -2), (0, 2)]
+                if 0 < r + dr < size - 1 and 0 < c + dc < size - 1 and not is_visited[r + dr, c + dc]]
+        if not nbrs:
+            stack.pop()
+            continue
+        nr, nc = nbrs[rng.integers(len(nbrs))]
+        is_visited[nr, nc] = True
+        panel[(r + nr) // 2, (c + nc) // 2] = False
+        panel[nr, nc] = False
+        stack.append((nr, nc))
+
+
+def generate_panels(size: int, seed: Optional[int] = None) -> Panels:
+    """Return the panels of a random maze of the given odd size, which has a path between opposite corners
+    (1, 1, 1) and (size-2, size-2, size-2).
+    A random monotone path between the corners is carved into all three panels first, so it stays open
+    in the cube, and then each panel gets a random 2D maze of its own.
+    """
+    if size < 5 or size % 2 == 0:
+        raise ValueError(f'OskarsMaze: Maze size must be odd and at least 5: {size}')
+    rng = np.random.default_rng(seed)
+    xy, yz, zx = [np.ones((size, size), dtype=bool) for _ in range(3)]
+    steps = np.repeat(np.arange(3), (size - 3) // 2)
+    rng.shuffle(steps)
+    pos = np.array([1, 1, 1])
+    cells = [tuple(pos)]
+    for axis in steps:
+        for _ in range(2):
+            pos[axis] += 1
+            cells.append(tuple(pos))
+    for x, y, z in cells:
+        xy[x, y] = yz[y, z] = zx[z, x] = False
+    for panel in [xy, yz, zx]:
+        _carve_panel_maze(panel, rng)
+    return (panel_to_str(xy), panel_to_str(yz), panel_to_str(zx))
+
+
+def parse_pos(s: str) -> Pos:
+    try:
+        x, y, z = map(int, s.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Position must be x,y,z: {s}')
+    return (x, y, z)
+
+
+def main(args: argparse.Namespace) -> None:
+    maze = OskarsMaze.from_file(args.file) if args.file else OskarsMaze()
+    name = args.file if args.file else "Oskar's Maze"
+    if args.command == 'stats':
+        print(f'INFO: {name} has {maze.number_of_cells()} open cells.')
+        print(f'INFO: {name} has {maze.number_of_nodes()} nodes.')
+        print(f'INFO: {name} has {maze.number_of_connected_components()} connected components.')
+    elif args.command == 'paths':
+        if args.index and os.path.isdir(args.index):
+            maze.load_path_index(args.index)
+        nodes = args.positions if args.positions else OskarsMaze.get_corners(maze.size)
+        try:
+            maze.print_paths(nodes)
+        except ValueError as e:
+            sys.exit(str(e))
+        if args.index and not os.path.isdir(args.index):
+            maze.save_path_index(args.index)
+    elif args.command == 'dot':
         # Convert to png with, e.g., dot -Tpng -o oskars_maze.png oskars_maze.dot
-        maze.write_dot(f)
+        maze.write_dot(args.output)
+
+
+class TestShortestPath(unittest.TestCase):
+    """Compares the contracted graph's paths with breadth-first search over the cell graph."""
+    @staticmethod
+    def _bfs_distances(cells: CellGraph, a: int) -> NDArray:
+        distances = np.full(len(cells), -1)
+        distances[a] = 0
+        frontier = [a]
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                for nbr in cells.neighbors(cell).tolist():
+                    if distances[nbr] < 0:
+                        distances[nbr] = distances[cell] + 1
+                        next_frontier.append(nbr)
+            frontier = next_frontier
+        return distances
+
+    def _check_paths(self, maze: OskarsMaze, pairs: List[Tuple[int, int]]) -> None:
+        self._check_cell_paths(maze.cells, maze.contracted, maze.get_path_index(), pairs)
+
+    def _check_cell_paths(self, cells: CellGraph, contracted: ContractedGraph, index: PathIndex,
+                          pairs: List[Tuple[int, int]]) -> None:
+        for path_index in [None, index]:
+            for a, b in pairs:
+                expected = int(self._bfs_distances(cells, a)[b])
+                result = contracted.shortest_path(a, b, path_index)
+                if expected < 0:
+                    self.assertIsNone(result)
+                    continue
+                self.assertIsNotNone(result)
+                length, path = result
+                self.assertEqual(length, expected)
+                self.assertEqual(len(path), length + 1)
+                self.assertEqual((path[0], path[-1]), (a, b))
+                for cell, next_cell in zip(path, path[1:]):
+                    self.assertIn(next_cell, cells.neighbors(cell).tolist())
+
+    def _get_pairs(self, maze: OskarsMaze, rng: np.random.Generator) -> List[Tuple[int, int]]:
+        """Random pairs of cells, pairs of cells in one corridor, and pairs of corridor cells next to nodes."""
+        contracted = maze.contracted
+        pairs = [tuple(rng.integers(0, len(maze.cells), 2).tolist()) for _ in range(30)]
+        for edge in rng.permutation(len(contracted.edge_ptr) - 1)[:10].tolist():
+            edge_cells = contracted.edge_cells[contracted.edge_ptr[edge]:contracted.edge_ptr[edge + 1]].tolist()
+            if not edge_cells:  # Two nodes next to each other
+                continue
+            pairs += [(edge_cells[0], edge_cells[-1]), (edge_cells[-1], edge_cells[0])]
+            pairs.append((edge_cells[0], int(rng.integers(len(maze.cells)))))
+        return pairs
+
+    def test_oskars_maze(self):
+        maze = OskarsMaze()
+        self._check_paths(maze, self._get_pairs(maze, np.random.default_rng(0)))
+
+    def test_random_mazes(self):
+        rng = np.random.default_rng(1)
+        for size, seed in [(5, 0), (11, 1), (11, 2), (21, 3)]:
+            maze = OskarsMaze(panels=generate_panels(size, seed))
+            self._check_paths(maze, self._get_pairs(maze, rng))
+
+    def test_loops(self):
+        # A loop whose one node joins a stem, and a loop with no node but the one chosen, apart.
+        rows = ['...##',
+                '.#...',
+                '...##',
+                '#####',
+                '...##',
+                '.#.##',
+                '...##']
+        cube = np.array([[[c == '#'] for c in row] for row in rows])
+        cells = CellGraph.from_cube(cube)
+        contracted = ContractedGraph(cells)
+        self.assertEqual(sum(a == b for a, b in contracted.edge_ends.tolist()), 2)  # Both loops are loop edges
+        positions = [cells.position(cell) for cell in contracted.node_cells.tolist()]
+        index = PathIndex.build(positions, contracted.weighted_nbrs())
+        self._check_cell_paths(cells, contracted, index, [(a, b) for a in range(len(cells)) for b in range(len(cells))])
+
+    def test_same_cell(self):
+        maze = OskarsMaze()
+        self.assertEqual(maze.contracted.shortest_path(7, 7), (0, [7]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find paths through Oskar's Maze, or another 3D projection maze.")
+    parser.add_argument('-f', '--file', type=str,
+            help="Specify path of file of the maze's xy, yz and zx panels [Default is Oskar's Maze]")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Print the numbers of cells, nodes and connected components')
+    paths_parser = subparsers.add_parser('paths', help='Print the shortest path length between each pair of positions')
+    paths_parser.add_argument('positions', type=parse_pos, nargs='*', metavar='X,Y,Z',
+            help='Specify positions [Default is the corners]')
+    paths_parser.add_argument('--index', type=str,
+            help='Specify directory of path index, which is loaded if it exists, or else saved')
+    dot_parser = subparsers.add_parser('dot', help='Write the graph in DOT format (needs pygraphviz)')
+    dot_parser.add_argument('-o', '--output', type=str, default='oskars_maze.dot',
+            help='Specify path of DOT file [Default is oskars_maze.dot]')
+    main(parser.parse_args())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# Benchmarks for oskars_maze.
+#
+# Generates a random maze of each size, and reports the time of each stage of the pipeline:
+# panel parsing, cube building, cell graph (CSR) construction, corridor contraction,
+# networkx graph construction, path index building and path queries between the corners.
+# A fixed seed makes the runs comparable.
+#
+# The path index holds a matrix over all pairs of contracted nodes, so it is skipped above
+# --max-index-nodes, and the queries then run Dijkstra's algorithm on the contracted graph.
+
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+from oskars_maze import CellGraph, ContractedGraph, OskarsMaze, PathIndex, generate_panels
+
+DEFAULT_SIZES = [11, 21, 51, 101, 201]
+DEFAULT_SEED = 1
+DEFAULT_MAX_INDEX_NODES = 2000
+STAGES = ['parse', 'cube', 'cells', 'contract', 'graph', 'index', 'queries']
+
+
+def run_size(size: int, seed: int, max_index_nodes: int) -> Tuple[int, int, Dict[str, float]]:
+    """Run each stage for a random maze of the given size.
+    Return the number of cells, the number of contracted nodes, and the seconds taken by each stage run.
+    """
+    panels = generate_panels(size, seed)
+    seconds: Dict[str, float] = {}
+
+    def timed(stage, f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        seconds[stage] = time.perf_counter() - start
+        return result
+
+    panel_xy, panel_yz, panel_zx = timed('parse', lambda: [OskarsMaze._get_panel(panel) for panel in panels])
+    cube = timed('cube', OskarsMaze._get_cube, panel_xy, panel_yz, panel_zx)
+    cells = timed('cells', CellGraph.from_cube, cube)
+    contracted = timed('contract', ContractedGraph, cells)
+    timed('graph', OskarsMaze._get_graph, cells, contracted)
+
+    corners = [cells.cell_id(corner) for corner in OskarsMaze.get_corners(size)]
+    corners = [corner for corner in corners if corner >= 0]
+    pairs = [(a, b) for k, a in enumerate(corners) for b in corners[k + 1:]]
+    path_index = None
+    if len(contracted) <= max_index_nodes:
+        positions = [cells.position(cell) for cell in contracted.node_cells.tolist()]
+        path_index = timed('index', PathIndex.build, positions, contracted.weighted_nbrs())
+    timed('queries', lambda: [contracted.shortest_path(a, b, path_index) for a, b in pairs])
+    return len(cells), len(contracted), seconds
+
+
+def main(sizes: List[int], seed: int, max_index_nodes: int) -> None:
+    print(f'{"Size":>5} {"Cells":>9} {"Nodes":>9}' + ''.join(f' {stage:>9}' for stage in STAGES))
+    for size in sizes:
+        cell_count, node_count, seconds = run_size(size, seed, max_index_nodes)
+        times = ''.join(f' {seconds[stage]:9.4f}' if stage in seconds else f' {"-":>9}' for stage in STAGES)
+        print(f'{size:5} {cell_count:9} {node_count:9}{times}', flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark oskars_maze on random mazes of increasing size.')
+    parser.add_argument('--sizes', type=str, default=','.join(map(str, DEFAULT_SIZES)),
+            help=f'Specify comma-separated odd maze sizes [Default is {",".join(map(str, DEFAULT_SIZES))}]')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+            help=f'Specify seed for the random mazes [Default is {DEFAULT_SEED}]')
+    parser.add_argument('--max-index-nodes', type=int, default=DEFAULT_MAX_INDEX_NODES,
+            help=f'Skip the path index for graphs with more nodes [Default is {DEFAULT_MAX_INDEX_NODES}]')
+    args = parser.parse_args()
+
+    main([int(size) for size in args.sizes.split(',')], args.seed, args.max_index_nodes)
@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 
-from typing import Dict
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import functools
+import heapq
+import os
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
 import unittest
 
 
@@ -14,16 +22,32 @@ def generator2list(f):
 
 # ----------------------------------------
 
+class CycleError(ValueError):
+    """ValueError raised for a cycle, which is given as a list of nodes, the first repeated at the end.
+    components lists every strongly connected component known to contain a cycle.
+    """
+    def __init__(self, msg, cycle, components=None):
+        super().__init__(f'{msg}: {" -> ".join(map(str, cycle))}')
+        self.cycle = cycle
+        self.components = components if components is not None else [cycle[:-1]]
+
+
 def is_tsorted(dep_rels:Dict, items):
-    dep_keys = dep_rels.keys()
-    prohibited = set()
-    for item in items:
-        if item in prohibited:
-            # Came across a dependency after seeing the item it depended on
+    """Returns whether items lists each node of dep_rels once, with each node before its dependencies.
+    Takes O(V+E) time.
+    """
+    positions = {}
+    for k, item in enumerate(items):
+        if item in positions:
             return False
-        if item in dep_keys:
-            for dep in dep_rels[item]:
-                prohibited.add(item)
+        positions[item] = k
+    for item, deps in dep_rels.items():
+        if item not in positions:
+            return False
+        for dep in deps:
+            if positions.get(dep, -1) <= positions[item]:
+                # Came across a dependency before (or without) the item that it follows
+                return False
     return True
 
 
@@ -49,36 +73,312 @@ def show_tsorted(dep_rels:Dict, verbose=True):
     return tsorted(dep_rels)
 
 
-def tsorted(dep_rels:Dict, verbose=True):
+def itsorted(dep_rels):
+    """Yields the nodes in topologically sorted order, each as soon as it is ready (Kahn's algorithm).
+    dep_rels - Dict: keys=all nodes ("start nodes"), values=dependencies
+               or an iterable of (node, dependency) pairs
+    Uses no recursion, and O(V+E) time and memory.
+    Raises ValueError if there is a cycle, after yielding the nodes not blocked by it.
+    """
+    followers = _get_followers(dep_rels)
+    in_degrees = dict.fromkeys(followers, 0)
+    for deps in followers.values():
+        for dep in deps:
+            in_degrees[dep] += 1
+    ready = deque(node for node, in_degree in in_degrees.items() if in_degree == 0)
+    yielded_count = 0
+    while ready:
+        node = ready.popleft()
+        yielded_count += 1
+        yield node
+        for dep in followers[node]:
+            in_degrees[dep] -= 1
+            if in_degrees[dep] == 0:
+                ready.append(dep)
+    if yielded_count < len(in_degrees):
+        # The nodes left unyielded are those in cycles, and those that follow cycles.
+        remaining = {node: [dep for dep in followers[node] if in_degrees[dep]]
+                     for node, in_degree in in_degrees.items() if in_degree}
+        components = find_cycles(remaining)
+        raise CycleError("Cycle detected", _get_cycle(remaining, components[0]), components)
+
+
+def _get_followers(dep_rels) -> Dict:
+    """Returns dep_rels as a Dict from each node to its dependencies."""
+    if isinstance(dep_rels, Mapping):
+        non_key_values = {dep for deps in dep_rels.values() for dep in deps if dep not in dep_rels}
+        if non_key_values:
+            raise ValueError(f'Some values depending others are not listed as items to be tsorted: {non_key_values}')
+        return dep_rels
+    followers: Dict = {}
+    for item, dep in dep_rels:
+        followers.setdefault(item, []).append(dep)
+        followers.setdefault(dep, [])
+    return followers
+
+
+def strongly_connected_components(dep_rels) -> List[List]:
+    """Returns the strongly connected components, in tsorted order: if an edge leads from one
+    component to another, the first comes before the second. Uses Tarjan's algorithm, with an
+    explicit stack instead of recursion, in O(V+E) time.
+    dep_rels - As for tsorted
+    """
+    followers = _get_followers(dep_rels)
+    indexes: Dict = {}
+    lowlinks: Dict = {}
+    stack: List = []
+    on_stack = set()
+    components: List[List] = []
+
+    def visit(node):
+        indexes[node] = lowlinks[node] = len(indexes)
+        stack.append(node)
+        on_stack.add(node)
+        work.append((node, iter(followers[node])))
+
+    for root in followers:
+        if root in indexes:
+            continue
+        work: List = []
+        visit(root)
+        while work:
+            node, deps = work[-1]
+            for dep in deps:
+                if dep not in indexes:
+                    visit(dep)
+                    break
+                if dep in on_stack:
+                    lowlinks[node] = min(lowlinks[node], indexes[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+                if lowlinks[node] == indexes[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    components.reverse()  # Tarjan's algorithm finds the components in reverse tsorted order.
+    return components
+
+
+def find_cycles(dep_rels) -> List[List]:
+    """Returns the strongly connected components that contain a cycle: those with more than one node,
+    and single nodes that depend on themselves.
+    """
+    followers = _get_followers(dep_rels)
+    return [component for component in strongly_connected_components(followers)
+            if len(component) > 1 or component[0] in followers[component[0]]]
+
+
+def _get_cycle(followers: Dict, component: List) -> List:
+    """Returns a cycle within a strongly connected component, as a list of nodes, the first repeated at the end."""
+    members = set(component)
+    path: List = []
+    path_positions: Dict = {}
+    node = component[0]
+    while node not in path_positions:
+        path_positions[node] = len(path)
+        path.append(node)
+        node = next(dep for dep in followers[node] if dep in members)
+    return path[path_positions[node]:] + [node]
+
+
+def tsorted_components(dep_rels) -> List[List]:
+    """Returns the nodes grouped into strongly connected components, with the components in tsorted order.
+    Unlike tsorted, this does not fail on cycles: each cycle is kept together in one component,
+    and the rest of the graph is still ordered around it.
+    """
+    return strongly_connected_components(dep_rels)
+
+
+def tsorted(dep_rels, verbose=True):
     """Returns a topologically sorted list of nodes.
     dep_rels - Dict: keys=all nodes ("start nodes"), values=dependencies
+               or an iterable of (node, dependency) pairs
     """
-    def add_followers(item):
-        nonlocal dep_rels, seen_nodes, result
-        if item not in seen_nodes:
-            seen_nodes.add(item)
-            for follower in dep_rels[item]:
-                add_followers(follower)
-            result.append(item)
-
-    if not dep_rels:
-        return []
-    required_nodes = set(dep_rels.keys())
-    after_nodes = set(join(dep_rels.values()))
-    non_key_values = after_nodes.difference(required_nodes)
-    if non_key_values:
-        raise ValueError(f'Some values depending others are not listed as items to be tsorted: {non_key_values}')
-    unseen_roots = required_nodes.difference(after_nodes)
-    if not unseen_roots:
-        raise ValueError("Cycle detected")
-    node_count = len(required_nodes.union(after_nodes))
-    seen_nodes = set()
-    result = []
-    while unseen_roots:
-        add_followers(unseen_roots.pop())
-    if len(result) < node_count:
-        raise ValueError("Cycle detected: Not all nodes reachable from start nodes")
-    return list(reversed(result))
+    return list(itsorted(dep_rels))
+
+# ----------------------------------------
+# Incremental topological order
+
+class IncrementalTsort:
+    """Topological order maintained as edges and nodes are added and removed
+    (Pearce and Kelly, "A Dynamic Topological Sort Algorithm for Directed Acyclic Graphs", 2006).
+
+    As for tsorted, an edge (item, dep) puts item before dep. Adding an edge that is already
+    consistent with the order costs O(1). Otherwise only the nodes between the two endpoints'
+    positions that are reachable from dep, or that reach item, are searched and reordered,
+    reusing their own positions. An edge that would create a cycle raises CycleError, and is not added.
+    """
+    def __init__(self, dep_rels=None):
+        self.followers: Dict[Any, Dict[Any, None]] = {}  # Dicts as insertion-ordered sets
+        self.preds: Dict[Any, Dict[Any, None]] = {}
+        self.positions: Dict[Any, int] = {}
+        self.nodes: List[Any] = []  # Node at each position
+        if dep_rels:
+            followers = _get_followers(dep_rels)
+            for node in tsorted(followers):
+                self.add_node(node)
+            for item, deps in followers.items():
+                for dep in deps:
+                    self.add_edge(item, dep)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def order(self) -> List:
+        return list(self.nodes)
+
+    def add_node(self, node) -> None:
+        if node not in self.positions:
+            self.positions[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.followers[node] = {}
+            self.preds[node] = {}
+
+    def add_edge(self, item, dep) -> None:
+        """Adds an edge putting item before dep. Raises CycleError if dep already leads to item."""
+        self.add_node(item)
+        self.add_node(dep)
+        if dep in self.followers[item]:
+            return
+        if item == dep:
+            raise CycleError('Adding edge would create a cycle', [item, dep])
+        lower, upper = self.positions[dep], self.positions[item]
+        if lower > upper:
+            self.followers[item][dep] = None
+            self.preds[dep][item] = None
+            return
+        # The order must change: search forward from dep and backward from item, within [lower, upper].
+        forward = self._search(dep, self.followers, lambda pos: pos <= upper, item)
+        if isinstance(forward, list):
+            raise CycleError('Adding edge would create a cycle', [item] + forward)
+        backward = self._search(item, self.preds, lambda pos: pos >= lower, None)
+        assert(isinstance(backward, dict))
+        # Nodes that reach item go first, then nodes reachable from dep, each keeping its relative order.
+        moved = sorted(backward, key=self.positions.__getitem__) + sorted(forward, key=self.positions.__getitem__)
+        for node, pos in zip(moved, sorted(self.positions[node] for node in moved)):
+            self.positions[node] = pos
+            self.nodes[pos] = node
+        self.followers[item][dep] = None
+        self.preds[dep][item] = None
+
+    def _search(self, start, edges: Dict, is_in_region, target):
+        """Returns the nodes reached from start through edges, within the region, as a Dict from each
+        node to the node it was reached from. If target is reached, returns the path from start to target.
+        """
+        reached = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for nbr in edges[node]:
+                if nbr == target:
+                    path = [nbr, node]
+                    while reached[path[-1]] is not None:
+                        path.append(reached[path[-1]])
+                    return list(reversed(path))
+                if nbr not in reached and is_in_region(self.positions[nbr]):
+                    reached[nbr] = node
+                    stack.append(nbr)
+        return reached
+
+    def remove_edge(self, item, dep) -> None:
+        """Removes an edge. The order stays valid, so it is not changed."""
+        del self.followers[item][dep]
+        del self.preds[dep][item]
+
+
+# ----------------------------------------
+# Scheduling
+
+@dataclass
+class TaskResult:
+    node: Any
+    status: str  # TASK_DONE, TASK_FAILED or TASK_SKIPPED
+    value: Any = None
+    error: Optional[BaseException] = None
+    start: float = 0.0  # Wall-clock time (time.time), comparable across processes
+    seconds: float = 0.0
+
+
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+TASK_SKIPPED = 'skipped'  # Not run, because a task failed
+
+
+def _timed_call(task):
+    start = time.time()
+    start_counter = time.perf_counter()
+    try:
+        value = task()
+    except Exception as ex:
+        return False, ex, start, time.perf_counter() - start_counter
+    return True, value, start, time.perf_counter() - start_counter
+
+
+def run_tsorted(dep_rels, tasks, max_workers=None, use_processes=False, keep_going=False, durations=None):
+    """Runs a task for each node, starting each as soon as the nodes it depends on are done.
+    dep_rels     - As for tsorted: each key's task runs before the tasks of its values
+    tasks        - Dict: keys=nodes, values=callables taking no arguments; or a callable taking a node
+    max_workers  - Maximum number of tasks run at once [Default is the CPU count]
+    use_processes - Run the tasks in a process pool (so the callables must be picklable), not a thread pool
+    keep_going   - If a task fails, keep running the tasks that do not depend on it, instead of stopping
+    durations    - Dict: estimated seconds per node [Default is 1 for each]
+    Of the ready tasks, the one heading the longest remaining chain of estimated durations
+    (the critical path) is started first.
+    Returns a Dict from each node, in tsorted order, to its TaskResult.
+    Raises ValueError for a cycle, before running any task.
+    """
+    followers = _get_followers(dep_rels)
+    order = tsorted(followers)
+    max_workers = max_workers or os.cpu_count() or 1
+    get_task = tasks.__getitem__ if isinstance(tasks, Mapping) else (lambda node: functools.partial(tasks, node))
+
+    # Critical path: a node's priority is its duration plus the largest priority among its followers.
+    priorities: Dict = {}
+    for node in reversed(order):
+        duration = durations.get(node, 1) if durations else 1
+        priorities[node] = duration + max((priorities[dep] for dep in followers[node]), default=0)
+    positions = {node: k for k, node in enumerate(order)}
+    waiting_counts = dict.fromkeys(order, 0)  # Count of unfinished tasks that each node waits for
+    for deps in followers.values():
+        for dep in deps:
+            waiting_counts[dep] += 1
+    ready = [(-priorities[node], positions[node], node) for node in order if waiting_counts[node] == 0]
+    heapq.heapify(ready)
+
+    results: Dict = {}
+    executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_type(max_workers=max_workers) as executor:
+        running: Dict[Future, Any] = {}
+        is_stopping = False
+        while running or (ready and not is_stopping):
+            while ready and not is_stopping and len(running) < max_workers:
+                node = heapq.heappop(ready)[2]
+                running[executor.submit(_timed_call, get_task(node))] = node
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                is_ok, value, start, seconds = future.result()
+                if not is_ok:
+                    results[node] = TaskResult(node, TASK_FAILED, error=value, start=start, seconds=seconds)
+                    is_stopping = is_stopping or not keep_going
+                    continue  # Its followers never become ready
+                results[node] = TaskResult(node, TASK_DONE, value=value, start=start, seconds=seconds)
+                for dep in followers[node]:
+                    waiting_counts[dep] -= 1
+                    if waiting_counts[dep] == 0:
+                        heapq.heappush(ready, (-priorities[dep], positions[dep], dep))
+    return {node: results.get(node) or TaskResult(node, TASK_SKIPPED) for node in order}
 
 # ----------------------------------------
 
@@ -93,6 +393,38 @@ class TestIsTsorted(unittest.TestCase):
         self.assertEqual(actual, expected)
 
 
+class TestIsTsortedInvalid(unittest.TestCase):
+    def test_is_tsorted_invalid(self):
+        dep_rels = {'a': ['b'], 'b': ['c'], 'c': []}
+        self.assertTrue(is_tsorted(dep_rels, ['a', 'b', 'c']))
+        self.assertFalse(is_tsorted(dep_rels, ['a', 'c', 'b']))
+        self.assertFalse(is_tsorted(dep_rels, ['a', 'b']))
+        self.assertFalse(is_tsorted(dep_rels, ['a', 'b', 'c', 'a']))
+
+
+class TestIncrementalTsort(unittest.TestCase):
+    def test_incremental_tsort(self):
+        order = IncrementalTsort(TestTsortedClothing.dep_rels)
+        dep_rels = {node: list(deps) for node, deps in TestTsortedClothing.dep_rels.items()}
+        self.assertTrue(is_tsorted(dep_rels, order))
+        for item, dep in [('watch', 'underwear'), ('coat', 'socks'), ('watch', 'shirt')]:
+            order.add_edge(item, dep)
+            dep_rels[item].append(dep)
+            self.assertTrue(is_tsorted(dep_rels, order))
+        order.remove_edge('coat', 'socks')
+        dep_rels['coat'].remove('socks')
+        order.add_edge('socks', 'watch')
+        dep_rels['socks'].append('watch')
+        self.assertTrue(is_tsorted(dep_rels, order))
+
+    def test_incremental_tsort_cycle(self):
+        order = IncrementalTsort({'a': ['b'], 'b': ['c'], 'c': []})
+        with self.assertRaises(CycleError) as context:
+            order.add_edge('c', 'a')
+        self.assertEqual(context.exception.cycle, ['c', 'a', 'b', 'c'])
+        self.assertEqual(order.order(), ['a', 'b', 'c'])
+
+
 class TestJoin(unittest.TestCase):
     def test_join_lists(self):
         xss = [ [ [1,2,3], [4,5,[6,7,8]], [9] ] ]
@@ -144,6 +476,95 @@ class TestTsortedClothing(unittest.TestCase):
         self.assertTrue(is_tsorted(self.__class__.dep_rels, result))
 
 
+class TestTsortedDeepChain(unittest.TestCase):
+    def test_tsorted_deep_chain(self):
+        count = 100000
+        dep_rels = {k: [k + 1] for k in range(count - 1)}
+        dep_rels[count - 1] = []
+        self.assertEqual(tsorted(dep_rels), list(range(count)))
+
+
+class TestTsortedEdges(unittest.TestCase):
+    def test_tsorted_edges(self):
+        edges = iter([('underwear', 'pants'), ('pants', 'shoes'), ('socks', 'shoes'), ('pants', 'belt')])
+        actual = tsorted(edges)
+        self.assertEqual(actual, ['underwear', 'socks', 'pants', 'shoes', 'belt'])
+
+    def test_tsorted_edges_cycle(self):
+        self.assertRaises(ValueError, tsorted, [('a', 'b'), ('b', 'a')])
+
+
+class TestItsorted(unittest.TestCase):
+    def test_itsorted_streams_before_cycle(self):
+        nodes = itsorted({'a': ['b'], 'b': ['c'], 'c': ['b']})
+        self.assertEqual(next(nodes), 'a')
+        self.assertRaises(ValueError, next, nodes)
+
+
+class TestRunTsorted(unittest.TestCase):
+    def test_run_tsorted_order(self):
+        finished = []
+        lock = threading.Lock()
+        def task(node):
+            time.sleep(0.01)
+            with lock:
+                finished.append(node)
+            return node.upper()
+        dep_rels = TestTsortedClothing.dep_rels
+        results = run_tsorted(dep_rels, task, max_workers=3)
+        self.assertTrue(is_tsorted(dep_rels, finished))
+        self.assertEqual(list(results), tsorted(dep_rels))
+        self.assertTrue(all(result.status == TASK_DONE for result in results.values()))
+        self.assertEqual(results['belt'].value, 'BELT')
+
+    def test_run_tsorted_failure(self):
+        def fail():
+            raise RuntimeError('fail')
+        dep_rels = {'a': ['b'], 'b': [], 'c': ['d'], 'd': []}
+        tasks = {'a': fail, 'b': lambda: 'b', 'c': lambda: 'c', 'd': lambda: 'd'}
+        results = run_tsorted(dep_rels, tasks, max_workers=1, keep_going=True,
+                              durations={'a': 10})  # Run 'a' first
+        self.assertEqual({node: result.status for node, result in results.items()},
+                         {'a': TASK_FAILED, 'b': TASK_SKIPPED, 'c': TASK_DONE, 'd': TASK_DONE})
+        self.assertIsInstance(results['a'].error, RuntimeError)
+        results = run_tsorted(dep_rels, tasks, max_workers=1, durations={'a': 10})
+        self.assertEqual([result.status for result in results.values()], [TASK_FAILED] + [TASK_SKIPPED] * 3)
+
+
+class TestStronglyConnectedComponents(unittest.TestCase):
+    dep_rels = { 'a': ['b']
+               , 'b': ['c', 'e']
+               , 'c': ['d']
+               , 'd': ['b']
+               , 'e': ['f']
+               , 'f': ['f']
+               , 'g': ['a']
+               }
+
+    def test_tsorted_components(self):
+        actual = [sorted(component) for component in tsorted_components(self.__class__.dep_rels)]
+        expected = [['g'], ['a'], ['b', 'c', 'd'], ['e'], ['f']]
+        self.assertEqual(actual, expected)
+
+    def test_find_cycles(self):
+        actual = sorted(sorted(component) for component in find_cycles(self.__class__.dep_rels))
+        self.assertEqual(actual, [['b', 'c', 'd'], ['f']])
+
+    def test_tsorted_cycle_error(self):
+        with self.assertRaises(CycleError) as context:
+            tsorted(self.__class__.dep_rels)
+        self.assertEqual(sorted(sorted(component) for component in context.exception.components),
+                         [['b', 'c', 'd'], ['f']])
+        cycle = context.exception.cycle
+        self.assertEqual(cycle[0], cycle[-1])
+        self.assertTrue(all(dep in self.__class__.dep_rels[node] for node, dep in zip(cycle, cycle[1:])))
+
+    def test_strongly_connected_components_deep_chain(self):
+        count = 100000
+        edges = [(k, k + 1) for k in range(count - 1)] + [(count - 1, 0)]
+        self.assertEqual(len(strongly_connected_components(edges)), 1)
+
+
 class TestTsortedIncomplete(unittest.TestCase):
     def test_tsorted_incomplete(self):
         dep_rels = { 'a': ['b']
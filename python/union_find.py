@@ -1,77 +1,420 @@
 #!/usr/bin/env python
 
-# TODO: Add path compression.
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import unittest
+from unittest import mock
+
+import numpy as np
+from numpy.typing import NDArray
 
 VERBOSE = True
 
-class UFNode:
-    def __init__(self, val):
-        self.val = val
-        self.rank = 0
-        self.parent = None
-        self.children = []
 
-    def __str__(self):
-        children_vals = [child.val for child in self.children]
-        result = f'value={self.val},rank={self.rank}; parent={self.parent}, children={",".join(map(str, children_vals))}'
-        return result
+class UnionFind:
+    """Disjoint sets of values, with path compression and union by rank,
+    so that each operation takes O(α(n)) amortized time.
 
+    Values are mapped to dense ids, and the parent and rank of each id are kept in flat arrays.
+    UnionFind(n) holds the values 0..n-1, which are their own ids, so no mapping is stored.
+    The members of a set are not stored, but listed on demand.
 
-class UnionFind:
+    The *_many methods and the component summaries work on NumPy arrays in whole-array passes,
+    for edge lists too large to union one pair at a time.
+    """
     def __init__(self, arg):
         if isinstance(arg, int) and arg > 1:
-            vals = range(arg)
+            self.vals: Optional[List[Any]] = None
+            self.ids: Optional[Dict[Any, int]] = None
+            size = arg
         else:
             assert(isinstance(arg, list))
-            vals = arg
-        self.nodes: Dict[Any, UFNode] = {val: UFNode(val) for val in vals}
-        self._assert_invariant()
-
-    def _adopt(self, root_p: UFNode, root_c: UFNode):
+            self.vals = list(dict.fromkeys(arg))
+            self.ids = {val: k for k, val in enumerate(self.vals)}
+            size = len(self.vals)
+        self._val_array: Optional[NDArray] = None  # self.vals as a 1-D object array, built on first use
+        self.parent = array('q', range(size))
+        self.rank = bytearray(size)  # Rank is at most log2(size)
         self._assert_invariant()
-        assert(root_p.val in self.nodes)
-        assert(root_c.val in self.nodes)
-        root_c.parent = root_p
-        root_p.rank = max(root_c.rank + 1, root_p.rank)
-        root_p.children += [root_c] + root_c.children
-        # root_c.children = []
 
     def _assert_invariant(self):
-        assert(isinstance(self.nodes, dict))
+        assert(len(self.parent) == len(self.rank))
+        assert(self.ids is None or len(self.ids) == len(self.parent))
 
-    def find_root(self, x) -> UFNode:
-        self._assert_invariant()
-        p: UFNode = self.nodes[x]
-        while True:
-            if p.parent:
-                p = p.parent
-            else:
-                break
-        assert(p)
-        return p
+    def _find(self, k: int) -> int:
+        parent = self.parent
+        root = k
+        while parent[root] != root:
+            root = parent[root]
+        while parent[k] != root:  # Path compression
+            parent[k], k = root, parent[k]
+        return root
+
+    def _id(self, x) -> int:
+        if self.ids is None:
+            if not (isinstance(x, int) and 0 <= x < len(self.parent)):
+                raise KeyError(x)
+            return x
+        return self.ids[x]
+
+    def _val(self, k: int):
+        return k if self.vals is None else self.vals[k]
+
+    def find_root(self, x):
+        """Return the value at the root of the set containing x."""
+        return self._val(self._find(self._id(x)))
 
     def is_equiv(self, x, y) -> bool:
-        self._assert_invariant()
-        return self.find_root(x) == self.find_root(y)
+        return self._find(self._id(x)) == self._find(self._id(y))
+
+    def members(self, x) -> List:
+        """Return the values in the set containing x. Takes O(n) time."""
+        root = self._find(self._id(x))
+        return [self._val(k) for k in range(len(self.parent)) if self._find(k) == root]
+
+    def sets(self) -> Dict[Any, List]:
+        """Return a dict from the root value of each set to the values in that set."""
+        root2members: Dict[int, List] = {}
+        for k in range(len(self.parent)):
+            root2members.setdefault(self._find(k), []).append(self._val(k))
+        return {self._val(root): members for root, members in root2members.items()}
 
     def print(self, msg):
         self._assert_invariant()
         print(msg)
-        for node in [node for node in self.nodes.values() if node.parent is None]:
-            children_values = [child.val for child in node.children]
-            print(f'\tUFNode: Children of {node.val}: {children_values}')
+        for root, members in self.sets().items():
+            children_values = [val for val in members if val != root]
+            print(f'\tUnionFind: Children of {root}: {children_values}')
 
     def union(self, x, y):
-        self._assert_invariant()
-        root_x = self.find_root(x)
-        root_y = self.find_root(y)
+        root_x = self._find(self._id(x))
+        root_y = self._find(self._id(y))
         if root_x == root_y:
             return
+        if self.rank[root_x] < self.rank[root_y]:
+            root_x, root_y = root_y, root_x
+        self.parent[root_y] = root_x
+        if self.rank[root_x] == self.rank[root_y]:
+            self.rank[root_x] += 1
+
+    # ----------------------------------------
+    # Batch operations
+
+    def _parent_array(self) -> NDArray:
+        return np.frombuffer(self.parent, dtype=np.int64)  # A view, so writes update self.parent
+
+    def _ids_many(self, xs) -> NDArray:
+        if self.ids is None:
+            ids = np.asarray(xs, dtype=np.int64)
+            if ids.size and (ids.min() < 0 or ids.max() >= len(self.parent)):
+                raise KeyError('UnionFind: Values out of range')
+            return ids
+        return np.fromiter(map(self.ids.__getitem__, xs), dtype=np.int64)
+
+    def _vals_many(self, ids: NDArray) -> NDArray:
+        if self.vals is None:
+            return ids
+        if self._val_array is None:
+            # Filled by slice assignment, so that values such as tuples stay single elements.
+            self._val_array = np.empty(len(self.vals), dtype=object)
+            self._val_array[:] = self.vals
+        return self._val_array[ids]
+
+    def _flatten(self) -> NDArray:
+        """Point every id directly at its root, by pointer jumping. Return the parent array."""
+        parent = self._parent_array()
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent[:] = grandparent
+        # Every tree now has height at most 1, which keeps the ranks valid for later unions.
+        rank = np.frombuffer(self.rank, dtype=np.uint8)
+        rank[:] = 0
+        rank[parent[parent != np.arange(len(parent))]] = 1
+        return parent
+
+    def union_many(self, xs, ys) -> None:
+        """Union xs[k] with ys[k] for each k.
+        Each pass hooks the larger root of each pair under the smallest root paired with it,
+        then flattens all trees, until each pair has the same root. Hooking only to smaller ids
+        cannot create cycles, and taking the minimum over all pairs (rather than letting one
+        arbitrary write win) hooks every pair in every pass, so a hub with many leaves takes two passes.
+        """
+        if len(xs) != len(ys):
+            raise ValueError('UnionFind.union_many: xs and ys differ in length')
+        ids_x = self._ids_many(xs)
+        ids_y = self._ids_many(ys)
+        parent = self._flatten()
+        roots_x = parent[ids_x]
+        roots_y = parent[ids_y]
+        while True:
+            is_apart = roots_x != roots_y
+            roots_x = roots_x[is_apart]
+            roots_y = roots_y[is_apart]
+            if not roots_x.size:
+                break
+            np.minimum.at(parent, np.maximum(roots_x, roots_y), np.minimum(roots_x, roots_y))
+            parent = self._flatten()
+            roots_x = parent[roots_x]
+            roots_y = parent[roots_y]
+
+    def find_many(self, xs) -> NDArray:
+        """Return the root value of each of xs, compressing their paths."""
+        ids = self._ids_many(xs)
+        parent = self._parent_array()
+        roots = parent[ids]
+        while True:
+            grandparents = parent[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+        parent[ids] = roots
+        return self._vals_many(roots)
+
+    def component_labels(self) -> NDArray:
+        """Return a label for each value (in id order), numbering the sets 0, 1, 2, ..."""
+        _, labels = np.unique(self._flatten(), return_inverse=True)
+        return labels
+
+    def component_sizes(self) -> NDArray:
+        """Return the size of each set, indexed by the labels of component_labels."""
+        return np.bincount(self.component_labels())
+
+    def num_components(self) -> int:
+        return int(np.count_nonzero(self._parent_array() == np.arange(len(self.parent))))
+
+
+class RollbackUnionFind(UnionFind):
+    """UnionFind whose unions can be undone, most recent first.
+    Union by rank without path compression keeps trees O(log n) deep, and lets each union be undone
+    in O(1) by restoring one parent and one rank. checkpoint() returns a position in the history of
+    unions, and rollback(checkpoint) undoes the unions made since.
+    """
+    def __init__(self, arg):
+        super().__init__(arg)
+        self.history: List[Optional[Tuple[int, int]]] = []  # (child root, parent root's old rank), or None
+
+    def _find(self, k: int) -> int:
+        parent = self.parent
+        while parent[k] != k:
+            k = parent[k]
+        return k
+
+    def union(self, x, y):
+        root_x = self._find(self._id(x))
+        root_y = self._find(self._id(y))
+        if root_x == root_y:
+            self.history.append(None)
+            return
+        if self.rank[root_x] < self.rank[root_y]:
+            root_x, root_y = root_y, root_x
+        self.history.append((root_y, self.rank[root_x]))
+        self.parent[root_y] = root_x
+        if self.rank[root_x] == self.rank[root_y]:
+            self.rank[root_x] += 1
+
+    def checkpoint(self) -> int:
+        return len(self.history)
+
+    def rollback(self, checkpoint: int) -> None:
+        if not 0 <= checkpoint <= len(self.history):
+            raise ValueError(f'RollbackUnionFind.rollback: Invalid checkpoint: {checkpoint}')
+        while len(self.history) > checkpoint:
+            entry = self.history.pop()
+            if entry:
+                child, old_rank = entry
+                self.rank[self.parent[child]] = old_rank
+                self.parent[child] = child
+
+    # The batch operations of UnionFind rewrite parents wholesale, which would lose the history.
+
+    def _flatten(self) -> NDArray:
+        parent = self._parent_array().copy()
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+
+    def union_many(self, xs, ys) -> None:
+        for x, y in zip(xs, ys):
+            self.union(x, y)
+
+    def find_many(self, xs) -> NDArray:
+        return self._vals_many(self._flatten()[self._ids_many(xs)])
+
+
+def offline_dynamic_connectivity(arg, events: Sequence[Tuple[str, Any, Any]]) -> List[bool]:
+    """Answer connectivity queries over a timeline of edge insertions and deletions.
+    arg is as for UnionFind. Each event is ('add', x, y), ('remove', x, y) or ('query', x, y).
+    Returns, for each query in order, whether x and y are connected at that point.
+
+    Each edge is present over a range of queries. The ranges are stored in a segment tree over the
+    queries, and a depth-first walk of the tree unions each node's edges on the way down and rolls
+    them back on the way up, so each query sees exactly the edges present at its time.
+    Takes O((E log Q + Q) log n) time for E edge insertions and Q queries.
+    """
+    uf = RollbackUnionFind(arg)
+    queries: List[Tuple[Any, Any]] = []
+    open_edges: Dict[Tuple[int, int], List[Tuple[Any, Any, int]]] = {}  # edge -> stack of (x, y, first query)
+    edge_ranges: List[Tuple[Any, Any, int, int]] = []  # (x, y, first query, end query)
+    for op, x, y in events:
+        key = tuple(sorted((uf._id(x), uf._id(y))))
+        if op == 'add':
+            open_edges.setdefault(key, []).append((x, y, len(queries)))
+        elif op == 'remove':
+            if not open_edges.get(key):
+                raise ValueError(f'offline_dynamic_connectivity: Removing absent edge: {x}, {y}')
+            edge_x, edge_y, start = open_edges[key].pop()
+            edge_ranges.append((edge_x, edge_y, start, len(queries)))
+        elif op == 'query':
+            queries.append((x, y))
         else:
-            if root_x.rank >= root_y.rank:
-                self._adopt(root_x, root_y)
-            else:
-                self._adopt(root_y, root_x)
+            raise ValueError(f'offline_dynamic_connectivity: Unknown event: {op}')
+    for stack in open_edges.values():
+        edge_ranges += [(x, y, start, len(queries)) for (x, y, start) in stack]
+    if not queries:
+        return []
+
+    size = 1
+    while size < len(queries):
+        size *= 2
+    node_edges: List[List[Tuple[Any, Any]]] = [[] for _ in range(2 * size)]
+    for (x, y, start, end) in edge_ranges:
+        lo, hi = start + size, end + size
+        while lo < hi:
+            if lo & 1:
+                node_edges[lo].append((x, y))
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                node_edges[hi].append((x, y))
+            lo //= 2
+            hi //= 2
+
+    answers: List[bool] = []
+    def visit(node: int):
+        checkpoint = uf.checkpoint()
+        for (x, y) in node_edges[node]:
+            uf.union(x, y)
+        if node >= size:
+            query_k = node - size
+            if query_k < len(queries):
+                answers.append(uf.is_equiv(*queries[query_k]))
+        else:
+            visit(2 * node)
+            visit(2 * node + 1)
+        uf.rollback(checkpoint)
+    visit(1)
+    return answers
+
+
+class TestFindMany(unittest.TestCase):
+    def test_tuple_values(self):
+        uf = UnionFind([(0, 1), (2, 3), (4, 5)])
+        uf.union((0, 1), (2, 3))
+        roots = uf.find_many([(2, 3), (4, 5)])
+        self.assertEqual(roots.shape, (2,))
+        self.assertEqual(roots.tolist(), [uf.find_root((0, 1)), (4, 5)])
+
+    def test_ints(self):
+        uf = UnionFind(5)
+        uf.union_many([0, 3], [1, 4])
+        self.assertEqual(uf.find_many([0, 1, 2, 4]).tolist(), [0, 0, 2, 3])
+
+
+class TestUnionMany(unittest.TestCase):
+    def test_hub_with_many_leaves(self):
+        count = 100000
+        uf = UnionFind(count + 2)
+        with mock.patch.object(uf, '_flatten', wraps=uf._flatten) as flatten:
+            uf.union_many(np.full(count, count), np.arange(count))
+        self.assertEqual(flatten.call_count, 3)  # Once up front, then after each of two passes
+        self.assertEqual(uf.num_components(), 2)  # The hub with its leaves, and count + 1 alone
+        self.assertTrue(uf.is_equiv(0, count))
+        self.assertFalse(uf.is_equiv(0, count + 1))
+
+    def test_matches_union(self):
+        rng = np.random.default_rng(0)
+        xs = rng.integers(0, 500, 400)
+        ys = rng.integers(0, 500, 400)
+        batch = UnionFind(500)
+        batch.union_many(xs, ys)
+        single = UnionFind(500)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            single.union(x, y)
+        self.assertEqual(sorted(batch.sets().values()), sorted(single.sets().values()))
+
+
+class TestRollbackUnionFind(unittest.TestCase):
+    def test_rollback_restores_parent_and_rank(self):
+        uf = RollbackUnionFind(6)
+        uf.union(0, 1)
+        checkpoint = uf.checkpoint()
+        parent, rank = list(uf.parent), list(uf.rank)
+        uf.union(2, 3)
+        uf.union(0, 2)
+        uf.union(1, 3)  # Already joined, but still recorded
+        uf.union(4, 5)
+        self.assertTrue(uf.is_equiv(1, 3))
+        uf.rollback(checkpoint)
+        self.assertEqual((list(uf.parent), list(uf.rank)), (parent, rank))
+        self.assertTrue(uf.is_equiv(0, 1))
+        self.assertFalse(uf.is_equiv(2, 3))
+        uf.rollback(0)
+        self.assertEqual(uf.num_components(), 6)
+
+    def test_invalid_checkpoint(self):
+        uf = RollbackUnionFind(3)
+        with self.assertRaises(ValueError):
+            uf.rollback(1)
+
+
+class TestOfflineDynamicConnectivity(unittest.TestCase):
+    def test_timeline(self):
+        events = [('query', 'a', 'b'),
+                  ('add', 'a', 'b'),
+                  ('add', 'b', 'c'),
+                  ('query', 'a', 'c'),
+                  ('remove', 'b', 'a'),
+                  ('query', 'a', 'c'),
+                  ('query', 'b', 'c'),
+                  ('add', 'a', 'c'),
+                  ('add', 'a', 'c'),
+                  ('remove', 'c', 'a'),
+                  ('query', 'a', 'b'),
+                  ('remove', 'b', 'c'),
+                  ('query', 'a', 'b'),
+                  ('query', 'a', 'd')]
+        self.assertEqual(offline_dynamic_connectivity(['a', 'b', 'c', 'd'], events),
+                         [False, True, False, True, True, False, False])
+
+    def test_matches_rebuild(self):
+        rng = np.random.default_rng(1)
+        for _ in range(20):
+            events, edges, expected = [], [], []
+            for _ in range(40):
+                x, y = rng.integers(0, 6, 2).tolist()
+                op = rng.choice(['add', 'remove', 'query'])
+                if op == 'remove' and edges:
+                    x, y = edges.pop(int(rng.integers(len(edges))))
+                elif op == 'query':
+                    uf = UnionFind(6)
+                    for edge in edges:
+                        uf.union(*edge)
+                    expected.append(uf.is_equiv(x, y))
+                else:
+                    op = 'add'
+                    edges.append((x, y))
+                events.append((op, x, y))
+            self.assertEqual(offline_dynamic_connectivity(6, events), expected)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            offline_dynamic_connectivity(3, [('remove', 0, 1)])
+        with self.assertRaises(ValueError):
+            offline_dynamic_connectivity(3, [('link', 0, 1)])
 
 
 if __name__ == '__main__':